@@ -0,0 +1,352 @@
+import time
+import numpy as np
+import pandas as pd
+from cache_utils import LRUCache
+from city_index import get_city_index, normalize_city_key
+from data_store import get_data_store
+
+# Day counts above these AQI values are precomputed; they are the lower
+# bounds of the Poor, Very Poor and Severe buckets
+EXCEEDANCE_THRESHOLDS = (100, 200, 300)
+DEFAULT_THRESHOLD = 100
+
+ROLLUP_PERIODS = {
+    'daily': 'D',
+    'monthly': 'M',
+    'yearly': 'Y'
+}
+
+def _parse_day(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return pd.Timestamp(value).to_datetime64().astype('datetime64[D]')
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name} date: {value}")
+
+class CitySeries:
+    """
+    Daily rollup of one city's AQI with prefix sums over days, so the
+    average and exceedance-day count of any day range are two subtractions,
+    and a sparse table of daily maxima, so its peak is two lookups.
+    """
+    def __init__(self, name, first_day, prefix_sum, prefix_days, prefix_exceed, sparse_max):
+        self.name = name
+        self.first_day = first_day
+        self.prefix_sum = prefix_sum
+        self.prefix_days = prefix_days
+        self.prefix_exceed = prefix_exceed
+        self.sparse_max = sparse_max
+
+    @property
+    def n_days(self):
+        return len(self.prefix_days) - 1
+
+    @property
+    def last_day(self):
+        return self.first_day + np.timedelta64(self.n_days - 1, 'D')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build from a city's date-sorted rows; several readings on one day
+        count as one day with their mean and maximum
+        """
+        aqi = rows['aqi'].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(aqi)
+        day = rows['date'].to_numpy().astype('datetime64[D]')[valid]
+        aqi = aqi[valid]
+        name = str(rows['city'].iat[0])
+        if len(aqi) == 0:
+            return None
+
+        first_day = day[0]
+        offsets = (day - first_day).astype(np.int64)
+        n_days = int(offsets[-1]) + 1
+
+        count = np.bincount(offsets, minlength=n_days)
+        total = np.bincount(offsets, weights=aqi, minlength=n_days)
+        observed = count > 0
+        mean = np.where(observed, total / np.maximum(count, 1), 0.0)
+        daily_max = np.full(n_days, -np.inf)
+        np.maximum.at(daily_max, offsets, aqi)
+
+        prefix_sum = np.r_[0.0, np.cumsum(mean)]
+        prefix_days = np.r_[0, np.cumsum(observed)]
+        prefix_exceed = {
+            threshold: np.r_[0, np.cumsum(observed & (mean > threshold))]
+            for threshold in EXCEEDANCE_THRESHOLDS
+        }
+
+        # sparse_max[k][i] is the maximum of the 2**k days starting at i
+        sparse_max = [daily_max]
+        while 2 ** len(sparse_max) <= n_days:
+            previous, half = sparse_max[-1], 2 ** (len(sparse_max) - 1)
+            sparse_max.append(np.maximum(previous[:-half], previous[half:]))
+
+        return cls(name, first_day, prefix_sum, prefix_days, prefix_exceed, sparse_max)
+
+    def _offsets(self, start, end):
+        lo = 0 if start is None else int((start - self.first_day).astype(np.int64))
+        hi = self.n_days - 1 if end is None else int((end - self.first_day).astype(np.int64))
+        return max(lo, 0), min(hi, self.n_days - 1)
+
+    def range_stats(self, lo, hi, threshold=DEFAULT_THRESHOLD):
+        """
+        Days with data, average, peak and exceedance days of the day offsets
+        [lo, hi] (arrays of equal length), all in constant time per range
+        """
+        lo = np.asarray(lo, dtype=np.int64)
+        hi = np.asarray(hi, dtype=np.int64)
+        empty = hi < lo
+        lo_c = np.where(empty, 0, lo)
+        hi_c = np.where(empty, 0, hi)
+
+        days = np.where(empty, 0, self.prefix_days[hi_c + 1] - self.prefix_days[lo_c])
+        total = self.prefix_sum[hi_c + 1] - self.prefix_sum[lo_c]
+        exceed = np.where(empty, 0, self.prefix_exceed[threshold][hi_c + 1] - self.prefix_exceed[threshold][lo_c])
+
+        level = np.floor(np.log2(hi_c - lo_c + 1)).astype(np.int64)
+        peak = np.full(len(lo), -np.inf)
+        for k in np.unique(level):
+            selected = level == k
+            table = self.sparse_max[k]
+            peak[selected] = np.maximum(table[lo_c[selected]], table[hi_c[selected] - 2 ** k + 1])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average = np.where(days > 0, total / np.maximum(days, 1), np.nan)
+        peak = np.where((days > 0) & np.isfinite(peak), peak, np.nan)
+        return days, average, peak, exceed
+
+    def summary(self, start=None, end=None, threshold=DEFAULT_THRESHOLD):
+        """
+        Aggregates of the days between `start` and `end` (inclusive)
+        """
+        lo, hi = self._offsets(start, end)
+        days, average, peak, exceed = self.range_stats([lo], [hi], threshold)
+        return _stats_record(days[0], average[0], peak[0], exceed[0])
+
+    def rollup(self, period, start=None, end=None, threshold=DEFAULT_THRESHOLD):
+        """
+        Aggregates of every day, month or year between `start` and `end`
+        """
+        lo, hi = self._offsets(start, end)
+        if hi < lo:
+            return []
+
+        unit = ROLLUP_PERIODS[period]
+        first = self.first_day + np.timedelta64(lo, 'D')
+        last = self.first_day + np.timedelta64(hi, 'D')
+        periods = np.arange(first.astype(f'datetime64[{unit}]'), last.astype(f'datetime64[{unit}]') + 1)
+
+        starts = (periods.astype('datetime64[D]') - self.first_day).astype(np.int64)
+        stops = np.r_[starts[1:] - 1, hi]
+        starts = np.maximum(starts, lo)
+
+        days, average, peak, exceed = self.range_stats(starts, stops, threshold)
+        labels = periods.astype(str)
+        return [
+            dict(period=labels[i], **_stats_record(days[i], average[i], peak[i], exceed[i]))
+            for i in range(len(periods))
+        ]
+
+def _stats_record(days, average, peak, exceed):
+    return {
+        'days': int(days),
+        'avg_aqi': None if np.isnan(average) else round(float(average), 2),
+        'max_aqi': None if np.isnan(peak) else float(peak),
+        'exceedance_days': int(exceed)
+    }
+
+class AggregateIndex:
+    """
+    Per-city aggregate series of one dataset snapshot
+    """
+    def __init__(self, series, build_seconds):
+        self.series = series
+        self.build_seconds = build_seconds
+
+    @classmethod
+    def build(cls, snapshot):
+        started = time.perf_counter()
+        index = get_city_index(snapshot)
+
+        # After an append only the cities that received rows are rebuilt
+        parent = snapshot.parent.peek('aggregates') if snapshot.parent is not None else None
+        series = {}
+        for key, (start, stop) in index.ranges.items():
+            if parent is not None and key not in snapshot.changed_keys and key in parent.series:
+                series[key] = parent.series[key]
+            else:
+                city_series = CitySeries.from_rows(index.frame.iloc[start:stop])
+                if city_series is not None:
+                    series[key] = city_series
+
+        return cls(series, time.perf_counter() - started)
+
+    def get(self, location):
+        return self.series.get(normalize_city_key(location))
+
+def get_aggregates(snapshot=None):
+    """
+    Get the aggregate index of the given snapshot, or the current dataset version
+    """
+    if snapshot is None:
+        snapshot = get_data_store().snapshot()
+    return snapshot.derived('aggregates', AggregateIndex.build)
+
+def parse_threshold(value):
+    if value is None:
+        return DEFAULT_THRESHOLD
+    try:
+        threshold = int(value)
+    except (TypeError, ValueError):
+        threshold = None
+    if threshold not in EXCEEDANCE_THRESHOLDS:
+        raise ValueError(f"threshold must be one of {list(EXCEEDANCE_THRESHOLDS)}")
+    return threshold
+
+def resolve_range(series, start=None, end=None, days=None):
+    """
+    Resolve a request range to days; `days` selects the last N days of the
+    city's data (or ending at `end`)
+    """
+    start = _parse_day(start, 'start')
+    end = _parse_day(end, 'end')
+    if days is not None:
+        days = int(days)
+        if days <= 0:
+            raise ValueError('days must be positive')
+        end = end if end is not None else series.last_day
+        start = end - np.timedelta64(days - 1, 'D')
+    return start, end
+
+def get_city_aggregates(location, start=None, end=None, days=None, threshold=None, rollup=None):
+    """
+    Average, peak and exceedance days of a city over a date range, with an
+    optional daily, monthly or yearly breakdown. Returns None for unknown cities.
+    """
+    series = get_aggregates().get(location)
+    if series is None:
+        return None
+
+    threshold = parse_threshold(threshold)
+    if rollup is not None and rollup not in ROLLUP_PERIODS:
+        raise ValueError(f"Unknown rollup: {rollup}")
+    start, end = resolve_range(series, start, end, days)
+
+    result = {
+        'city': series.name,
+        'start': str(start if start is not None else series.first_day),
+        'end': str(end if end is not None else series.last_day),
+        'threshold': threshold,
+        **series.summary(start, end, threshold)
+    }
+    if rollup is not None:
+        result['rollup'] = series.rollup(rollup, start, end, threshold)
+    return result
+
+RANKING_METRICS = {
+    'average': 'avg_aqi',
+    'peak': 'max_aqi',
+    'exceedance': 'exceedance_days'
+}
+
+def _rankings_cache(snapshot):
+    return LRUCache(max_entries=256)
+
+def _metric_values(aggregates, metric, start, end, threshold):
+    """
+    Metric of every city over a date range, NaN for cities without data in it
+    """
+    keys = list(aggregates.series)
+    values = np.full(len(keys), np.nan)
+    for i, key in enumerate(keys):
+        series = aggregates.series[key]
+        lo, hi = series._offsets(start, end)
+        days, average, peak, exceed = series.range_stats([lo], [hi], threshold)
+        if days[0] > 0:
+            values[i] = {'average': average, 'peak': peak, 'exceedance': exceed}[metric][0]
+    return keys, values
+
+def _select(values, k, ascending):
+    """
+    Positions of the k largest (or smallest) non-NaN values, best first,
+    found by partial selection so only those k are sorted
+    """
+    candidates = np.flatnonzero(~np.isnan(values))
+    scores = values[candidates] if ascending else -values[candidates]
+    if k < len(candidates):
+        chosen = np.argpartition(scores, k - 1)[:k]
+    else:
+        chosen = np.arange(len(candidates))
+    return candidates[chosen[np.argsort(scores[chosen], kind='stable')]]
+
+def rank_cities(metric='average', k=10, order='top', start=None, end=None, days=None, threshold=None):
+    """
+    The k most (order='top') or least (order='bottom') polluted cities by
+    average AQI, peak AQI or exceedance days over a date range. Each entry
+    also carries the city's rank by the same metric over all data.
+
+    `days` selects the last N days of the dataset. Results are cached per
+    range for the current dataset version.
+    """
+    if metric not in RANKING_METRICS:
+        raise ValueError(f"Unknown ranking metric: {metric}")
+    if order not in ('top', 'bottom'):
+        raise ValueError("order must be 'top' or 'bottom'")
+    k = int(k)
+    if k <= 0:
+        raise ValueError('k must be positive')
+    threshold = parse_threshold(threshold)
+
+    snapshot = get_data_store().snapshot()
+    aggregates = get_aggregates(snapshot)
+    if not aggregates.series:
+        return {'metric': metric, 'order': order, 'start': None, 'end': None, 'cities': []}
+
+    start = _parse_day(start, 'start')
+    end = _parse_day(end, 'end')
+    if days is not None:
+        days = int(days)
+        if days <= 0:
+            raise ValueError('days must be positive')
+        if end is None:
+            end = max(series.last_day for series in aggregates.series.values())
+        start = end - np.timedelta64(days - 1, 'D')
+
+    cache = snapshot.derived('rankings_cache', _rankings_cache)
+
+    def compute():
+        keys, values = _metric_values(aggregates, metric, start, end, threshold)
+        _, overall = cache.get_or_compute(
+            ('overall', metric, threshold),
+            lambda: _metric_values(aggregates, metric, None, None, threshold)
+        )
+
+        cities = []
+        for position in _select(values, k, ascending=(order == 'bottom')):
+            series = aggregates.series[keys[position]]
+            value = values[position]
+            historical = overall[position]
+            cities.append({
+                'rank': len(cities) + 1,
+                'city': series.name,
+                'value': round(float(value), 2),
+                'historical_value': None if np.isnan(historical) else round(float(historical), 2),
+                # Rank among all cities by the same metric over the whole dataset
+                'historical_rank': None if np.isnan(historical) else int(
+                    (overall > historical).sum() if order == 'top' else (overall < historical).sum()) + 1,
+                **series.summary(start, end, threshold)
+            })
+        return cities
+
+    key = (metric, k, order, str(start), str(end), threshold)
+    return {
+        'metric': metric,
+        'order': order,
+        'threshold': threshold,
+        'start': None if start is None else str(start),
+        'end': None if end is None else str(end),
+        'cities': cache.get_or_compute(key, compute)
+    }
@@ -1,11 +1,16 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 import pandas as pd
-from utils import get_latest_aqi_by_location, get_historical_data, get_available_cities
-from forecast_model import forecast_aqi
+from utils import get_latest_aqi_by_location, get_available_cities, get_pollutant_series
+from city_index import frame_to_records, normalize_city_key
+from history_utils import query_history, downsample_history, iter_ndjson, iter_columnar_json
+from forecast_model import forecast_aqi, forecast_batch, parse_quantiles, parse_horizon
 from health_recommendations import get_health_recommendations, get_alert_threshold_message
 from heatmap_utils import generate_heatmap_data, get_aqi_statistics
-from push_notifications import get_notification_manager
+from push_notifications import get_notification_manager, parse_cooldown_minutes
+from ingestion import get_ingestor, CsvTailIngestor
+from aggregates import get_city_aggregates, rank_cities
+from data_cleaning import get_quality_report
 import json
 import uuid
 import os
@@ -13,6 +18,10 @@ import os
 app = Flask(__name__, static_folder='frontend/build', static_url_path='')
 CORS(app)  # Enable CORS for React frontend
 
+# Optionally follow a CSV that an external collector appends readings to
+if os.environ.get('AQI_INGEST_TAIL'):
+    CsvTailIngestor(os.environ['AQI_INGEST_TAIL'], get_ingestor()).start()
+
 # Serve React App
 @app.route('/')
 @app.route('/<path:path>')
@@ -45,17 +54,113 @@ def get_aqi():
 def get_history():
     data = request.get_json()
     location = data.get('location')
+    output_format = data.get('format', 'records')
     
     try:
-        historical_data = get_historical_data(location)
+        if data.get('points') is not None:
+            # Downsampled series cover the whole range, so they are not paged
+            if data.get('limit') is not None or data.get('cursor') is not None:
+                return jsonify({'error': 'points cannot be combined with limit or cursor'}), 400
+            historical_data = downsample_history(
+                location,
+                data.get('points'),
+                start=data.get('start'),
+                end=data.get('end'),
+                method=data.get('downsample', 'lttb')
+            )
+            next_cursor = None
+        else:
+            historical_data, next_cursor = query_history(
+                location,
+                start=data.get('start'),
+                end=data.get('end'),
+                limit=data.get('limit'),
+                cursor=data.get('cursor')
+            )
         
         # Ensure column names match (lowercase, stripped)
         if not all(col in historical_data.columns for col in ['date', 'aqi']):
             return jsonify({'error': f"No valid 'date' or 'aqi' data found for {location}"}), 400
         
+        if output_format == 'ndjson':
+            response = Response(iter_ndjson(historical_data), mimetype='application/x-ndjson')
+            if next_cursor:
+                response.headers['X-Next-Cursor'] = next_cursor
+            return response
+        
+        if output_format == 'columnar':
+            return Response(iter_columnar_json(historical_data, next_cursor), mimetype='application/json')
+        
+        if output_format != 'records':
+            return jsonify({'error': f"Unknown format: {output_format}"}), 400
+        
         # Convert DataFrame to JSON-serializable format
-        history_json = historical_data.to_dict('records')
+        history_json = frame_to_records(historical_data)
+        
+        # Paged requests get the cursor alongside the rows
+        if data.get('limit') is not None or data.get('cursor') is not None:
+            return jsonify({'data': history_json, 'next_cursor': next_cursor})
         return jsonify(history_json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pollutants', methods=['POST'])
+def get_pollutants():
+    data = request.get_json()
+    location = data.get('location')
+    pollutants = data.get('pollutants')
+    
+    try:
+        series = get_pollutant_series(location, pollutants)
+        if series:
+            return jsonify(series)
+        else:
+            return jsonify({'error': 'Location not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/aggregates', methods=['POST'])
+def get_aggregates():
+    data = request.get_json()
+    location = data.get('location')
+    
+    try:
+        aggregates = get_city_aggregates(
+            location,
+            start=data.get('start'),
+            end=data.get('end'),
+            days=data.get('days'),
+            threshold=data.get('threshold'),
+            rollup=data.get('rollup')
+        )
+        if aggregates:
+            return jsonify(aggregates)
+        else:
+            return jsonify({'error': 'Location not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/rankings', methods=['GET', 'POST'])
+def get_rankings():
+    data = request.get_json(silent=True) or request.args.to_dict()
+    
+    try:
+        rankings = rank_cities(
+            metric=data.get('metric', 'average'),
+            k=data.get('k', 10),
+            order=data.get('order', 'top'),
+            start=data.get('start'),
+            end=data.get('end'),
+            days=data.get('days'),
+            threshold=data.get('threshold')
+        )
+        return jsonify(rankings)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -65,11 +170,34 @@ def get_forecast():
     location = data.get('location')
     
     try:
-        forecast = forecast_aqi(location)
+        quantiles = parse_quantiles(data.get('quantiles'))
+        horizon = parse_horizon(data.get('horizon'))
+        forecast = forecast_aqi(location, quantiles, horizon)
         if forecast:
             return jsonify(forecast)
         else:
-            return jsonify({'error': 'Unable to generate forecast'}), 404
+            return jsonify({'error': f'No forecast available for "{location}"'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/forecast/batch', methods=['POST'])
+def get_forecast_batch():
+    data = request.get_json()
+    cities = data.get('cities')
+    
+    try:
+        if cities == 'all':
+            cities = None
+        elif not isinstance(cities, list) or not cities:
+            return jsonify({'error': 'cities must be a list of city names or "all"'}), 400
+        
+        quantiles = parse_quantiles(data.get('quantiles'))
+        horizon = parse_horizon(data.get('horizon'))
+        return jsonify(forecast_batch(cities, quantiles, horizon))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -117,13 +245,19 @@ def notifications():
             threshold = data.get('threshold', 100)
             age_group = data.get('age_group')
             health_conditions = data.get('health_conditions', [])
+            cooldown_minutes = parse_cooldown_minutes(data.get('cooldown_minutes'))
+            transport = data.get('transport', 'log')
+            address = data.get('address')
             
             success = notification_manager.subscribe_user(
                 user_id=user_id, 
                 location=location, 
                 threshold=threshold, 
                 age_group=age_group, 
-                health_conditions=health_conditions
+                health_conditions=health_conditions,
+                cooldown_minutes=cooldown_minutes,
+                transport=transport,
+                address=address
             )
             
             if success:
@@ -133,7 +267,9 @@ def notifications():
                     'location': location,
                     'threshold': threshold,
                     'age_group': age_group,
-                    'health_conditions': health_conditions
+                    'health_conditions': health_conditions,
+                    'cooldown_minutes': cooldown_minutes,
+                    'transport': transport
                 })
             else:
                 return jsonify({'error': 'Failed to subscribe'}), 500
@@ -155,6 +291,15 @@ def notifications():
         
         else:
             return jsonify({'error': 'Invalid action'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/notifications/metrics', methods=['GET'])
+def notification_metrics():
+    try:
+        return jsonify(get_notification_manager().get_metrics())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -167,6 +312,42 @@ def subscriptions():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    data = request.get_json()
+    readings = data.get('readings') if isinstance(data, dict) else data
+    
+    if not isinstance(readings, list):
+        return jsonify({'error': 'readings must be a list'}), 400
+    
+    try:
+        ingestor = get_ingestor()
+        result = ingestor.submit(readings, flush=bool(isinstance(data, dict) and data.get('flush')))
+        result['stats'] = ingestor.stats()
+        return jsonify(result), 202
+    except RuntimeError as e:
+        # Workers attached to a shared dataset cannot append to it
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/quality', methods=['GET'])
+def get_quality():
+    location = request.args.get('location')
+    
+    try:
+        report = get_quality_report()
+        if location is None:
+            return jsonify(report)
+        
+        city_report = report['cities'].get(normalize_city_key(location))
+        if city_report:
+            return jsonify(city_report)
+        else:
+            return jsonify({'error': 'Location not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/cities', methods=['GET'])
 def get_cities():
     try:
@@ -1,7 +1,7 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_from_directory, url_for
 from flask_cors import CORS
-import pandas as pd
-from utils import get_latest_aqi_by_location, get_historical_data
+from utils import get_latest_aqi_by_location
+from chart_service import get_chart_service, RETRY_AFTER
 from forecast_model import forecast_aqi
 from health_recommendations import get_health_recommendations, get_alert_threshold_message
 from heatmap_utils import generate_heatmap_data, get_aqi_statistics
@@ -43,7 +43,10 @@ def api_get_forecast():
         return jsonify({'error': 'Location is required'}), 400
     
     forecast = forecast_aqi(location)
-    return jsonify(forecast)
+    if forecast:
+        return jsonify(forecast)
+    else:
+        return jsonify({'error': f'No forecast available for "{location}"'}), 404
 
 @app.route('/api/health-alerts', methods=['POST'])
 def api_health_alerts():
@@ -159,15 +162,30 @@ def show_aqi():
 @app.route('/history', methods=['POST'])
 def show_history():
     location = request.form['location']
-    historical_data = get_historical_data(location)
+    start = request.form.get('start') or None
+    end = request.form.get('end') or None
+
+    try:
+        chart = get_chart_service().get_chart(location, start, end)
+    except ValueError as e:
+        return str(e), 400
+    except TimeoutError as e:
+        return str(e), 503, {'Retry-After': str(RETRY_AFTER)}
 
-    # Ensure column names match (lowercase, stripped)
-    if not all(col in historical_data.columns for col in ['date', 'aqi']):
+    if chart is None:
         return f"No valid 'date' or 'aqi' data found for {location}", 400
 
-    graph = historical_data.plot(x='date', y='aqi', title=f"AQI History - {location}").get_figure()
-    graph.savefig('static/history.png')
-    return render_template('history.html', location=location)
+    return render_template('history.html', location=location,
+                           chart_url=url_for('history_chart', filename=chart))
+
+@app.route('/history/chart/<filename>')
+def history_chart(filename):
+    # Chart files are named after the dataset version, so they never change
+    response = send_from_directory(get_chart_service().directory, filename, max_age=86400, conditional=True)
+    response.set_etag(filename.rsplit('.', 1)[0])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
 
 @app.route('/forecast', methods=['POST'])
 def show_forecast():
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import resource
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from city_index import CityIndex
+from data_store import DatasetStore, DATA_PATH
+from forecast_model import build_series_matrix, fit_series, predict
+
+def _metrics(errors, actuals):
+    """
+    MAE, RMSE and MAPE of the observed errors in each column
+    """
+    observed = ~np.isnan(errors)
+    count = observed.sum(axis=0)
+    abs_errors = np.where(observed, np.abs(errors), 0.0)
+    squared = np.where(observed, errors ** 2, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nonzero = observed & (actuals != 0)
+        pct = np.where(nonzero, abs_errors / np.abs(np.where(nonzero, actuals, 1.0)), 0.0)
+        mae = abs_errors.sum(axis=0) / count
+        rmse = np.sqrt(squared.sum(axis=0) / count)
+        mape = 100 * pct.sum(axis=0) / nonzero.sum(axis=0)
+
+    return [
+        {
+            'n': int(count[h]),
+            'mae': _round(mae[h]),
+            'rmse': _round(rmse[h]),
+            'mape': _round(mape[h])
+        }
+        for h in range(errors.shape[1])
+    ]
+
+def _round(value):
+    return None if not np.isfinite(value) else round(float(value), 3)
+
+def _truncate(series, origins):
+    """
+    One row per origin holding the series truncated after that origin
+    """
+    days = np.arange(len(series))
+    return np.where(days[None, :] <= origins[:, None], series[None, :], np.nan)
+
+def _peak_alloc(series, first_day, origins, horizon):
+    """
+    Peak traced allocation of one untimed fit and predict, in bytes
+    """
+    tracemalloc.start()
+    try:
+        predict(fit_series(_truncate(series, origins), first_day), horizon)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def evaluate_city(series, first_day, origins, horizon):
+    """
+    Rolling-origin evaluation of one city's daily series.
+
+    Every origin becomes one row of a matrix holding the series truncated
+    after that origin, so all origins are fitted in a single batch. Fit and
+    predict are timed untraced; memory is the peak traced allocation of a
+    separate pass over this city's fit and predict alone.
+    """
+    n_days = len(series)
+    truncated = _truncate(series, origins)
+
+    started = time.perf_counter()
+    params = fit_series(truncated, first_day)
+    fit_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    forecasts = predict(params, horizon)
+    predict_seconds = time.perf_counter() - started
+
+    # Compare against what was actually observed h days after each origin's
+    # last observation
+    target = params['last_day'][:, None] + np.arange(1, horizon + 1)[None, :]
+    inside = (params['last_day'][:, None] >= 0) & (target < n_days)
+    actuals = np.where(inside, series[np.minimum(target, n_days - 1)], np.nan)
+
+    return {
+        'origins': int(len(origins)),
+        'fit_seconds': round(fit_seconds, 4),
+        'predict_seconds': round(predict_seconds, 6),
+        'peak_alloc_kb': _peak_alloc(series, first_day, origins, horizon) // 1024,
+        'horizons': _metrics(forecasts - actuals, actuals),
+        'errors': (forecasts - actuals).tolist(),
+        'actuals': actuals.tolist()
+    }
+
+def _origins(series, n_origins, step, horizon):
+    """
+    Origins spaced `step` days apart, ending `horizon` days before the last
+    observation so every origin has data to score against
+    """
+    observed = np.flatnonzero(~np.isnan(series))
+    if len(observed) == 0:
+        return np.array([], dtype=np.int64)
+    last = observed[-1] - horizon
+    origins = last - step * np.arange(n_origins)[::-1]
+    return origins[origins > observed[0]]
+
+def run_backtest(path=DATA_PATH, n_origins=12, step=30, horizon=7, workers=None):
+    """
+    Backtest the forecast model for every city in the dataset on a process
+    pool and return a machine-readable report
+    """
+    wall_started = time.perf_counter()
+    store = DatasetStore(path)
+    snapshot = store.snapshot()
+    index = CityIndex.build(snapshot)
+    keys, first_day, matrix = build_series_matrix(index)
+    names = [str(index.frame['city'].iat[start]) for start, _ in index.ranges.values()]
+
+    jobs = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, name in enumerate(names):
+            origins = _origins(matrix[i], n_origins, step, horizon)
+            if len(origins):
+                jobs[name] = executor.submit(evaluate_city, matrix[i], first_day, origins, horizon)
+        results = {name: job.result() for name, job in jobs.items()}
+
+    # Overall metrics pool the errors of every city
+    if results:
+        all_errors = np.vstack([np.asarray(r.pop('errors'), dtype=float) for r in results.values()])
+        all_actuals = np.vstack([np.asarray(r.pop('actuals'), dtype=float) for r in results.values()])
+        overall = _metrics(all_errors, all_actuals)
+    else:
+        overall = []
+
+    return {
+        'dataset': {
+            'path': path,
+            'rows': int(len(snapshot.frame)),
+            'cities': len(keys),
+            'first_date': str(first_day) if first_day is not None else None,
+            'days': int(matrix.shape[1])
+        },
+        'config': {
+            'origins': n_origins,
+            'step_days': step,
+            'horizon': horizon,
+            'workers': workers or os.cpu_count()
+        },
+        'summary': {
+            'horizons': {str(h + 1): metrics for h, metrics in enumerate(overall)},
+            'fit_seconds_total': round(sum(r['fit_seconds'] for r in results.values()), 4),
+            'predict_seconds_total': round(sum(r['predict_seconds'] for r in results.values()), 6),
+            # Whole run: this process or the largest worker, whichever peaked higher
+            'peak_rss_kb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+            'peak_alloc_kb': max((r['peak_alloc_kb'] for r in results.values()), default=0),
+            'wall_seconds': round(time.perf_counter() - wall_started, 3)
+        },
+        'cities': {
+            name: dict(result, horizons={str(h + 1): m for h, m in enumerate(result['horizons'])})
+            for name, result in sorted(results.items())
+        }
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolling-origin backtest of the AQI forecast model')
+    parser.add_argument('--path', default=DATA_PATH)
+    parser.add_argument('--origins', type=int, default=12, help='Forecast origins per city')
+    parser.add_argument('--step', type=int, default=30, help='Days between origins')
+    parser.add_argument('--horizon', type=int, default=7, help='Days forecast from each origin')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run_backtest(args.path, args.origins, args.step, args.horizon, args.workers)
+    text = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"Wrote backtest report for {report['dataset']['cities']} cities to {args.output}")
+    else:
+        print(text)
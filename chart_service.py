@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from city_index import normalize_city_key
+from data_store import get_data_store
+from history_utils import downsample_history
+
+CHART_DIR = 'static/charts'
+
+# Rendered charts never need more points than the image has pixels
+CHART_POINTS = 1000
+
+# Seconds a client should wait before asking again for a chart still rendering
+RETRY_AFTER = 5
+
+class ChartService:
+    """
+    Renders history charts on a bounded worker pool into per-(city, range)
+    image files named after the dataset version, so a cached file is always
+    current and can be served with a long-lived ETag.
+    """
+    def __init__(self, directory=CHART_DIR, max_workers=2, max_bytes=64 * 1024 * 1024, timeout=30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chart')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def chart_key(self, location, start=None, end=None):
+        """
+        Cache key of a chart: dataset version, city and date range
+        """
+        snapshot = get_data_store().snapshot()
+        raw = f"{snapshot.source_stat}|{normalize_city_key(location)}|{start}|{end}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get_chart(self, location, start=None, end=None):
+        """
+        Get the file name of the chart for a city and range, rendering it if
+        needed. Returns None when the city has no data in the range and
+        raises TimeoutError when the render outlasts the timeout.
+        """
+        key = self.chart_key(location, start, end)
+        filename = f"{key}.png"
+        path = os.path.join(self.directory, filename)
+
+        if os.path.exists(path):
+            # Mark as recently used for the size-capped eviction
+            os.utime(path)
+            return filename
+
+        # Concurrent requests for the same chart share one render; the entry
+        # stays until the render finishes, even if every waiter timed out
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, location, start, end, path)
+                self._pending[key] = future
+                created = True
+            else:
+                created = False
+        if created:
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        try:
+            rendered = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Chart for {location} is still rendering") from None
+
+        return filename if rendered else None
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def _render(self, location, start, end, path):
+        rows = downsample_history(location, CHART_POINTS, start=start, end=end)
+        if rows.empty:
+            return False
+
+        # A standalone Figure keeps no global pyplot state, so nothing leaks
+        figure = Figure(figsize=(8, 4))
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        axes.plot(rows['date'], rows['aqi'], label='aqi')
+        axes.set_title(f"AQI History - {location}")
+        axes.set_xlabel('date')
+        axes.legend()
+        figure.autofmt_xdate()
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.tmp{threading.get_ident()}"
+        figure.savefig(tmp, format='png')
+        os.replace(tmp, path)
+
+        self._evict()
+        return True
+
+    def _evict(self):
+        """
+        Delete least recently used charts until the directory fits max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+# Global chart service instance
+chart_service = ChartService()
+
+def get_chart_service():
+    """
+    Get the global chart service instance
+    """
+    return chart_service
@@ -0,0 +1,189 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from data_store import get_data_store
+
+def normalize_city_key(city):
+    """
+    Normalize a city name into the key used for lookups
+    """
+    return str(city).strip().lower()
+
+def frame_to_records(frame):
+    """
+    Convert rows to JSON-friendly dicts: float32 readings are rounded so they
+    do not serialize with float32 noise, and missing values become None
+    """
+    rounded = {
+        column: frame[column].astype(np.float64).round(2)
+        for column in frame.columns if frame[column].dtype == np.float32
+    }
+    records = frame.assign(**rounded).to_dict(orient='records')
+
+    for record in records:
+        for key, value in record.items():
+            if pd.isna(value):
+                record[key] = None
+
+    return records
+
+class CityIndex:
+    """
+    Per-city index over one dataset snapshot.
+
+    Rows are reordered so that each city occupies a contiguous, date-sorted
+    range of `frame`; lookups are a dict access followed by a slice.
+    """
+    def __init__(self, frame, ranges, latest, latest_rows, build_seconds, latest_positions=None):
+        self.frame = frame
+        self.ranges = ranges
+        self.latest = latest
+        self.latest_rows = latest_rows
+        self.build_seconds = build_seconds
+        self.latest_positions = latest_positions or {}
+
+    @classmethod
+    def build(cls, snapshot):
+        started = time.perf_counter()
+        df = snapshot.frame
+
+        if df.empty:
+            return cls(df, {}, {}, df, time.perf_counter() - started)
+
+        parent = snapshot.parent.peek('city_index') if snapshot.parent is not None else None
+        if parent is not None and snapshot.appended is not None:
+            return cls._build_appended(snapshot, parent, started)
+
+        keys = df['city'].astype(str).str.strip().str.lower()
+        order = pd.DataFrame({'key': keys.to_numpy(), 'date': df['date'].to_numpy()}) \
+            .sort_values(['key', 'date'], kind='mergesort').index.to_numpy()
+        if np.array_equal(order, np.arange(len(df))):
+            # The store already delivers rows in city/date order
+            frame = df
+        else:
+            frame = df.iloc[order].reset_index(drop=True)
+        sorted_keys = keys.to_numpy()[order]
+
+        # Start of every run of equal keys
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        stops = np.r_[starts[1:], len(frame)]
+
+        # Last position with a valid AQI inside each run, or -1 if none
+        positions = np.where(frame['aqi'].notna().to_numpy(), np.arange(len(frame)), -1)
+        latest_positions = np.maximum.reduceat(positions, starts)
+
+        ranges = {}
+        latest = {}
+        has_latest = latest_positions >= 0
+        latest_rows = frame.iloc[latest_positions[has_latest]].reset_index(drop=True)
+        records = frame_to_records(latest_rows)
+        latest_keys = sorted_keys[starts[has_latest]]
+
+        for key, start, stop in zip(sorted_keys[starts], starts, stops):
+            ranges[key] = (int(start), int(stop))
+
+        for key, record in zip(latest_keys, records):
+            latest[key] = record
+
+        positions = dict(zip(latest_keys, (int(p) for p in latest_positions[has_latest])))
+        return cls(frame, ranges, latest, latest_rows, time.perf_counter() - started, positions)
+
+    @classmethod
+    def _build_appended(cls, snapshot, parent, started):
+        """
+        Derive the index of a snapshot made by appending rows from the index
+        of its parent: unchanged cities keep their sizes and latest records,
+        so only the cities that received rows are looked at
+        """
+        frame = snapshot.frame
+        changed = snapshot.changed_keys
+
+        # Cleaning may drop or add rows of the changed cities, so their
+        # sizes are counted from the category codes of the new frame
+        city = frame['city'].array
+        category_keys = [normalize_city_key(c) for c in city.categories]
+        counts = np.bincount(city.codes[city.codes >= 0], minlength=len(category_keys))
+        sizes = {}
+        for key, count in zip(category_keys, counts):
+            sizes[key] = sizes.get(key, 0) + int(count)
+
+        ranges = {}
+        latest = {}
+        positions = {}
+        offset = 0
+        aqi_valid = frame['aqi'].notna().to_numpy()
+
+        # The store keeps cities in key order, so ranges follow sorted keys
+        for key in sorted(set(parent.ranges) | changed):
+            if not sizes.get(key):
+                continue
+            old_start, old_stop = parent.ranges.get(key, (0, 0))
+            start = offset
+            stop = start + sizes[key]
+            ranges[key] = (start, stop)
+            offset = stop
+
+            if key in changed:
+                valid = np.flatnonzero(aqi_valid[start:stop])
+                if len(valid):
+                    positions[key] = start + int(valid[-1])
+            elif key in parent.latest_positions:
+                positions[key] = start + parent.latest_positions[key] - old_start
+                latest[key] = parent.latest[key]
+
+        keys = list(positions)
+        latest_rows = frame.iloc[list(positions.values())].reset_index(drop=True)
+        stale = [i for i, key in enumerate(keys) if key not in latest]
+        for i, record in zip(stale, frame_to_records(latest_rows.iloc[stale])):
+            latest[keys[i]] = record
+
+        latest = {key: latest[key] for key in positions}
+        return cls(frame, ranges, latest, latest_rows, time.perf_counter() - started, positions)
+
+    def get_rows(self, location):
+        """
+        Get the date-sorted rows of a city, or an empty frame if unknown
+        """
+        bounds = self.ranges.get(normalize_city_key(location))
+        if bounds is None:
+            return self.frame.iloc[0:0]
+        return self.frame.iloc[bounds[0]:bounds[1]]
+
+    def get_latest(self, location):
+        """
+        Get the latest record with a valid AQI for a city
+        """
+        record = self.latest.get(normalize_city_key(location))
+        return dict(record) if record is not None else None
+
+    def has_city(self, location):
+        return normalize_city_key(location) in self.ranges
+
+    def memory_bytes(self):
+        """
+        Approximate memory held by the index, including its reordered frame
+        """
+        total = int(self.frame.memory_usage(deep=True).sum())
+        total += sys.getsizeof(self.ranges) + sys.getsizeof(self.latest)
+        total += sum(sys.getsizeof(record) for record in self.latest.values())
+        return total
+
+    def stats(self):
+        """
+        Report build time and memory footprint of the index
+        """
+        return {
+            'cities': len(self.ranges),
+            'rows': len(self.frame),
+            'build_ms': round(self.build_seconds * 1000, 3),
+            'memory_bytes': self.memory_bytes()
+        }
+
+def get_city_index(snapshot=None):
+    """
+    Get the city index for the given snapshot, or the current dataset version
+    """
+    if snapshot is None:
+        snapshot = get_data_store().snapshot()
+    return snapshot.derived('city_index', CityIndex.build)
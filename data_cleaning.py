@@ -0,0 +1,173 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from dataset_cache import POLLUTANT_COLUMNS
+from pollutants import aqi_bucket
+
+# AQI values above this are sensor or transcription errors and are clipped
+MAX_AQI = 1000
+
+# Gaps of at most this many missing days are filled by linear
+# interpolation; 0 leaves gaps alone
+FILL_GAP_DAYS = int(os.environ.get('AQI_FILL_GAP_DAYS', '0'))
+
+# Bits of the `quality_flags` column
+FLAG_NEGATIVE = 1       # a negative reading was discarded
+FLAG_CLIPPED = 2        # AQI was clipped to MAX_AQI
+FLAG_DUPLICATE = 4      # the row replaced earlier rows for the same city and date
+FLAG_INTERPOLATED = 8   # the row was interpolated into a gap
+
+FLAG_NAMES = {
+    FLAG_NEGATIVE: 'negative_values',
+    FLAG_CLIPPED: 'clipped_aqi',
+    FLAG_DUPLICATE: 'duplicates',
+    FLAG_INTERPOLATED: 'interpolated'
+}
+
+def flag_outliers(df):
+    """
+    Load pipeline stage: discard impossible negative readings (so AQI can
+    still be derived from the remaining pollutants), clip AQI above MAX_AQI
+    and record what was changed in the `quality_flags` column
+    """
+    flags = np.zeros(len(df), dtype=np.uint8)
+
+    readings = {}
+    for column in POLLUTANT_COLUMNS:
+        values = df[column].to_numpy()
+        negative = values < 0
+        if negative.any():
+            flags[negative] |= FLAG_NEGATIVE
+            readings[column] = np.where(negative, np.float32(np.nan), values)
+
+    aqi = df['aqi'].to_numpy(dtype=np.float64)
+    negative = aqi < 0
+    high = aqi > MAX_AQI
+    flags[negative] |= FLAG_NEGATIVE
+    flags[high] |= FLAG_CLIPPED
+    aqi = np.where(negative, np.nan, np.minimum(aqi, MAX_AQI))
+
+    # Clipped values fall into a different bucket than the source reported
+    bucket = df['aqi_bucket']
+    if high.any() or negative.any():
+        bucket = bucket.astype(object).where(~(high | negative), None)
+
+    return df.assign(aqi=aqi, aqi_bucket=bucket, quality_flags=flags, **readings)
+
+def clean_frame(df, key_ranks, fill_gap_days=FILL_GAP_DAYS):
+    """
+    Deduplicate (city, date) rows, keeping the last one, and fill gaps of
+    up to `fill_gap_days` missing days by linear interpolation.
+
+    `df` must be sorted by city key and date; `key_ranks` holds the rank of
+    every row's city key. Both steps compare each row with the next one, so
+    they are single vectorized passes over the frame.
+    """
+    if len(df) < 2:
+        return df
+
+    dates = df['date'].to_numpy()
+    same_key = key_ranks[1:] == key_ranks[:-1]
+    duplicate = same_key & (dates[1:] == dates[:-1])
+
+    if duplicate.any():
+        flags = df['quality_flags'].to_numpy().copy()
+        flags[1:][duplicate] |= FLAG_DUPLICATE
+        keep = np.r_[~duplicate, True]
+        df = df.assign(quality_flags=flags)[keep].reset_index(drop=True)
+        key_ranks = key_ranks[keep]
+        dates = dates[keep]
+        same_key = key_ranks[1:] == key_ranks[:-1]
+
+    if fill_gap_days <= 0:
+        return df
+
+    days = dates.astype('datetime64[D]')
+    gap = np.where(same_key, (days[1:] - days[:-1]).astype(np.int64) - 1, 0)
+    fill = (gap > 0) & (gap <= fill_gap_days)
+    if not fill.any():
+        return df
+
+    # One new row per missing day, interpolated between the rows around the gap
+    before = np.repeat(np.flatnonzero(fill), gap[fill])
+    step = np.arange(len(before)) - np.repeat(np.cumsum(gap[fill]) - gap[fill], gap[fill]) + 1
+    weight = step / (gap[before] + 1)
+
+    new_dates = days[before] + step.astype('timedelta64[D]')
+    new_columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in ('date', 'timestamp'):
+            new_columns[column] = new_dates.astype('datetime64[ns]')
+        elif column == 'quality_flags':
+            new_columns[column] = np.full(len(before), FLAG_INTERPOLATED, dtype=np.uint8)
+        elif column == 'aqi' or column in POLLUTANT_COLUMNS:
+            values = values.to_numpy()
+            new_columns[column] = (values[before] + (values[before + 1] - values[before]) * weight).astype(values.dtype)
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            new_columns[column] = pd.Categorical.from_codes(
+                np.full(len(before), -1, dtype=values.cat.codes.dtype), values.cat.categories)
+        else:
+            new_columns[column] = values.to_numpy()[before]
+
+    filled = pd.DataFrame(new_columns)
+    filled['city'] = pd.Categorical.from_codes(df['city'].cat.codes.to_numpy()[before], df['city'].cat.categories)
+    filled['aqi_bucket'] = pd.Categorical(aqi_bucket(filled['aqi'].to_numpy()), categories=df['aqi_bucket'].cat.categories)
+
+    # Each filled row goes right after the row before its gap
+    position = np.r_[np.arange(len(df)) * (fill_gap_days + 1), before * (fill_gap_days + 1) + step]
+    order = np.argsort(position, kind='stable')
+    return pd.concat([df, filled], ignore_index=True).iloc[order].reset_index(drop=True)
+
+def build_quality_report(snapshot):
+    """
+    Per-city data quality of one dataset version: rows, cleaning fixes
+    applied, and the missing days left between the first and last reading
+    """
+    # Imported here to avoid a cycle: data_store imports this module
+    from city_index import get_city_index
+
+    started = time.perf_counter()
+    index = get_city_index(snapshot)
+    frame = index.frame
+    if frame.empty:
+        return {'cities': {}, 'build_ms': 0.0}
+
+    flags = frame['quality_flags'].to_numpy() if 'quality_flags' in frame.columns \
+        else np.zeros(len(frame), dtype=np.uint8)
+    days = frame['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    cities = {}
+    for key, (start, stop) in index.ranges.items():
+        city_flags = flags[start:stop]
+        city_days = np.unique(days[start:stop])
+        gaps = np.diff(city_days) - 1
+        gaps = gaps[gaps > 0]
+        span = int(city_days[-1] - city_days[0]) + 1
+
+        report = {
+            'city': str(frame['city'].iat[start]),
+            'rows': int(stop - start),
+            'first_date': str(np.datetime64(int(city_days[0]), 'D')),
+            'last_date': str(np.datetime64(int(city_days[-1]), 'D')),
+            'gaps': int(len(gaps)),
+            'missing_days': int(gaps.sum()),
+            'longest_gap_days': int(gaps.max()) if len(gaps) else 0,
+            'completeness': round(len(city_days) / span, 4)
+        }
+        for bit, name in FLAG_NAMES.items():
+            report[name] = int(np.count_nonzero(city_flags & bit))
+        cities[key] = report
+
+    return {'cities': cities, 'build_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+def get_quality_report(snapshot=None):
+    """
+    Get the quality report of the given snapshot, or the current dataset version
+    """
+    from data_store import get_data_store
+
+    if snapshot is None:
+        snapshot = get_data_store().snapshot()
+    return snapshot.derived('quality_report', build_quality_report)
@@ -0,0 +1,371 @@
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from dataset_cache import load_columns, columns_from_frame, NAT, POLLUTANT_COLUMNS
+from data_cleaning import flag_outliers, clean_frame
+from pollutants import derive_missing_aqi
+from shared_dataset import read_current, attach_frame
+
+DATA_PATH = 'data/aqi_data.csv'
+
+# Vectorized stages run once per dataset version, after parsing and before
+# rows without an AQI are dropped. Each stage takes and returns the frame.
+# Cleaning that compares rows across a city's history (deduplication, gap
+# filling) runs afterwards on the merged, sorted frame.
+LOAD_STAGES = [flag_outliers, derive_missing_aqi]
+
+def log_path_for(path):
+    """
+    Append-only log of readings ingested on top of the CSV at `path`
+    """
+    return os.path.splitext(path)[0] + '.ingest.ndjson'
+
+def _key_ranks(cities):
+    """
+    Rank of every city category by its normalized key, so spellings of one
+    city share a rank and ranks follow key order
+    """
+    city_keys = np.array([str(c).strip().lower() for c in cities], dtype=object)
+    if len(city_keys) == 0:
+        return np.zeros(0, dtype=np.intp)
+    return np.unique(city_keys, return_inverse=True)[1]
+
+def _city_order(city_codes, cities, dates):
+    """
+    Stable order that makes each city's rows contiguous and date-sorted,
+    grouping cities by their normalized key
+    """
+    return np.lexsort((dates, _key_ranks(cities)[city_codes]))
+
+def _normalize_columns(arrays, categories):
+    """
+    Normalize typed columns into the frame the app works with: categorical
+    city, float32 pollutant readings (NaN where not measured) and the
+    dominant pollutant of every row
+    """
+    cities = np.asarray(categories['city'], dtype=object)
+    city_codes = np.asarray(arrays['city'])
+    dates = np.asarray(arrays['date'])
+
+    # Filter out rows with missing or empty city or date
+    blank_city = np.array([str(c).strip() == '' for c in cities], dtype=bool)
+    keep = (city_codes >= 0) & (dates != NAT)
+    keep[keep] = ~blank_city[city_codes[keep]]
+    rows = np.flatnonzero(keep)
+
+    # Keep each city's rows contiguous and date-sorted so the city index can
+    # use the frame as is instead of holding a reordered copy
+    rows = rows[_city_order(city_codes[rows], cities, dates[rows])]
+
+    date_values = pd.to_datetime(dates[rows], unit='ns')
+    readings = {column: np.asarray(arrays[column])[rows] for column in POLLUTANT_COLUMNS}
+    bucket_codes = np.asarray(arrays['AQI_Bucket'])[rows]
+
+    df = pd.DataFrame({
+        'city': pd.Categorical.from_codes(city_codes[rows], cities),
+        'date': date_values,
+        'aqi': np.asarray(arrays['AQI'])[rows].astype(np.float64),
+        'aqi_bucket': pd.Categorical.from_codes(bucket_codes, categories['AQI_Bucket']),
+        **readings
+    })
+
+    for stage in LOAD_STAGES:
+        df = stage(df)
+
+    # Drop rows whose AQI is neither reported nor derivable
+    df = df[df['aqi'].notna()].reset_index(drop=True)
+    df['timestamp'] = df['date']
+
+    return df
+
+def normalize_raw_rows(raw):
+    """
+    Normalize rows given in the CSV schema (City, Date, pollutants, AQI,
+    AQI_Bucket) exactly like rows read from the CSV
+    """
+    return _normalize_columns(*columns_from_frame(raw))
+
+def merge_frames(base, extra):
+    """
+    Merge normalized rows into a normalized frame, keeping the city/date
+    order; on equal (city, date) the rows of `extra` come last.
+
+    `base` is already sorted, so only the new rows are sorted and placed
+    by binary search instead of re-sorting the whole frame.
+    """
+    if extra.empty:
+        return base
+    if base.empty:
+        return extra
+
+    columns = {}
+    for column in base.columns:
+        if isinstance(base[column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([base[column].array, extra[column].array], ignore_order=True)
+        else:
+            columns[column] = np.concatenate([base[column].to_numpy(), extra[column].to_numpy()])
+    merged = pd.DataFrame(columns)
+
+    n = len(base)
+    city = merged['city'].array
+    ranks = _key_ranks(city.categories)[city.codes]
+    dates = merged['date'].to_numpy()
+    base_ranks, base_dates = ranks[:n], dates[:n]
+
+    extra_order = np.lexsort((dates[n:], ranks[n:]))
+    extra_ranks, extra_dates = ranks[n:][extra_order], dates[n:][extra_order]
+    lo = np.searchsorted(base_ranks, extra_ranks, side='left')
+    hi = np.searchsorted(base_ranks, extra_ranks, side='right')
+    positions = np.array([
+        start + np.searchsorted(base_dates[start:stop], date, side='right')
+        for start, stop, date in zip(lo, hi, extra_dates)
+    ], dtype=np.intp)
+
+    order = np.insert(np.arange(n), positions, n + extra_order)
+    return merged.iloc[order].reset_index(drop=True)
+
+def _clean(df):
+    """
+    Deduplicate and gap-fill a normalized, sorted frame
+    """
+    if df.empty:
+        return df
+    city = df['city'].array
+    return clean_frame(df, _key_ranks(city.categories)[city.codes])
+
+def read_log(path):
+    """
+    Read the ingested rows logged for `path`, in the CSV schema
+    """
+    log_path = log_path_for(path)
+    if not os.path.exists(log_path) or os.path.getsize(log_path) == 0:
+        return pd.DataFrame()
+    return pd.read_json(log_path, lines=True, dtype=False, convert_dates=False)
+
+def _read_and_normalize(path):
+    """
+    Load the typed columns of the dataset, normalize them and replay the
+    ingestion log on top
+    """
+    df = _normalize_columns(*load_columns(path))
+
+    logged = read_log(path)
+    if not logged.empty:
+        df = merge_frames(df, normalize_raw_rows(logged))
+
+    return _clean(df)
+
+class DatasetSnapshot:
+    """
+    Immutable view of the normalized dataset at one version.
+
+    Readers must treat `frame` as read-only; anything computed from it
+    should be cached through `derived()` so it lives and dies with the
+    snapshot.
+    """
+    def __init__(self, frame, version, source_stat, parent=None, appended=None):
+        self.frame = frame
+        self.version = version
+        self.source_stat = source_stat
+        self.loaded_at = datetime.now()
+
+        # Set for snapshots produced by appending rows: builders may reuse
+        # the parent's structures for every city not in changed_keys
+        self.parent = parent
+        self.appended = appended
+        self.changed_keys = None
+        if appended is not None:
+            self.changed_keys = set(appended['city'].astype(str).str.strip().str.lower())
+        self._derived = {}
+        self._derived_lock = threading.RLock()
+
+    def peek(self, key):
+        """
+        Return the structure stored under `key` if it was already built
+        """
+        return self._derived.get(key)
+
+    def derived(self, key, builder):
+        """
+        Return the structure stored under `key`, building it on first use
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = builder(self)
+            return self._derived[key]
+
+class DatasetStore:
+    """
+    Process-wide owner of the dataset.
+
+    The CSV is parsed once and kept as a snapshot; a new snapshot is built
+    only when the file's mtime or size changes, and it replaces the old one
+    in a single assignment so readers never see a half-loaded dataset.
+
+    With `shared_dir` set, the store instead attaches to the generation
+    published there by `shared_dataset.py` and switches snapshots when the
+    generation counter moves.
+
+    Rows can also be appended in memory with `append()`; they are written
+    to an append-only log next to the CSV first and replayed on reload.
+    """
+    def __init__(self, path=DATA_PATH, shared_dir=None):
+        self.path = path
+        self.shared_dir = shared_dir
+        self.log_path = log_path_for(path)
+        self._snapshot = None
+        self._version = 0
+        self._load_lock = threading.Lock()
+        self._listeners = []
+
+    def is_shared(self):
+        """
+        True when the store serves a generation published by the loader
+        process, which is read-only here
+        """
+        return bool(self.shared_dir) and read_current(self.shared_dir) is not None
+
+    def _stat(self):
+        if self.shared_dir:
+            generation = read_current(self.shared_dir)
+            if generation is not None:
+                return ('generation', generation)
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except OSError:
+            log_size = 0
+        return ('file', st.st_mtime_ns, st.st_size, log_size)
+
+    def _load(self, stat):
+        frame = pd.DataFrame()
+        if stat is not None:
+            try:
+                if stat[0] == 'generation':
+                    frame = attach_frame(self.shared_dir, stat[1])
+                else:
+                    frame = _read_and_normalize(self.path)
+            except Exception as e:
+                print(f"Error loading data: {e}")
+
+        self._version += 1
+        return DatasetSnapshot(frame, self._version, stat)
+
+    def snapshot(self):
+        """
+        Get the current snapshot, reloading it if the source file changed
+        """
+        stat = self._stat()
+        current = self._snapshot
+        if current is not None and current.source_stat == stat:
+            return current
+
+        with self._load_lock:
+            # Another thread may have finished the reload while we waited
+            current = self._snapshot
+            if current is not None and current.source_stat == stat:
+                return current
+
+            snapshot = self._snapshot = self._load(stat)
+
+        self._publish(current, snapshot)
+        return snapshot
+
+    def add_listener(self, callback):
+        """
+        Call `callback(previous, snapshot)` whenever a new snapshot replaces
+        the current one, by a reload or an append. Callbacks run on the
+        thread that made the change and must return quickly.
+        """
+        self._listeners.append(callback)
+
+    def _publish(self, previous, snapshot):
+        for callback in list(self._listeners):
+            try:
+                callback(previous, snapshot)
+            except Exception as e:
+                print(f"Error in dataset listener: {e}")
+
+    def append(self, raw):
+        """
+        Append rows given in the CSV schema and publish them as a new
+        snapshot, without reparsing the dataset. Returns the new snapshot.
+        """
+        extra = normalize_raw_rows(raw)
+
+        with self._load_lock:
+            previous = current = self._snapshot
+            if current is None or current.source_stat != self._stat():
+                current = self._load(self._stat())
+
+            if current.source_stat is not None and current.source_stat[0] == 'generation':
+                raise RuntimeError('Cannot append to a shared dataset; ingest in a process without AQI_SHARED_DATASET_DIR')
+
+            # Persist before publishing so a reload never loses the rows
+            with open(self.log_path, 'a') as f:
+                f.write(raw.to_json(orient='records', lines=True, date_format='iso'))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Only the newest previous snapshot is kept as a parent
+            current.parent = None
+            self._version += 1
+            snapshot = DatasetSnapshot(_clean(merge_frames(current.frame, extra)), self._version, self._stat(),
+                                       parent=current, appended=extra)
+            self._snapshot = snapshot
+
+        self._publish(previous, snapshot)
+        return snapshot
+
+    def compact(self):
+        """
+        Fold the ingestion log into the CSV and truncate the log. The data
+        does not change, so the current snapshot stays valid.
+        """
+        with self._load_lock:
+            logged = read_log(self.path)
+            if logged.empty:
+                return 0
+
+            header = pd.read_csv(self.path, nrows=0).columns
+            rows = logged.reindex(columns=header)
+            with open(self.path, 'rb+') as f:
+                # Make sure the appended rows start on a new line
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        f.write(b'\n')
+            rows.to_csv(self.path, mode='a', header=False, index=False)
+            open(self.log_path, 'w').close()
+
+            if self._snapshot is not None:
+                self._snapshot.source_stat = self._stat()
+            return len(rows)
+
+    def get_frame(self):
+        """
+        Get the normalized dataset of the current snapshot
+        """
+        return self.snapshot().frame
+
+# Global dataset store instance
+data_store = DatasetStore(shared_dir=os.environ.get('AQI_SHARED_DATASET_DIR'))
+
+def get_data_store():
+    """
+    Get the global dataset store instance
+    """
+    return data_store
@@ -0,0 +1,162 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+POLLUTANT_COLUMNS = ['PM2.5', 'PM10', 'NO', 'NO2', 'NOx', 'NH3', 'CO', 'SO2', 'O3',
+                     'Benzene', 'Toluene', 'Xylene']
+
+CACHE_FORMAT_VERSION = 1
+
+# Sentinel stored in the int64 date column for unparseable dates
+NAT = np.iinfo(np.int64).min
+
+def _file_hash(path):
+    """
+    SHA-256 of the source file, used as the sidecar key
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def sidecar_path(path, source_hash):
+    """
+    Directory holding the columnar sidecar of `path` for a given source hash
+    """
+    return f"{path}.{source_hash[:16]}.cols"
+
+def _encode_strings(series):
+    """
+    Dictionary-encode a string column into int32 codes (-1 for missing)
+    """
+    codes, categories = pd.factorize(series, use_na_sentinel=True)
+    return codes.astype(np.int32), [str(c) for c in categories]
+
+def parse_csv_columns(path):
+    """
+    Parse the CSV into typed columns: dictionary-encoded city and bucket,
+    int64 dates (ns since epoch) and float32 readings
+    """
+    return columns_from_frame(pd.read_csv(path))
+
+def columns_from_frame(df):
+    """
+    Convert rows in the CSV schema into the typed columns of the sidecar
+    """
+    def numeric(column):
+        if column not in df.columns:
+            return np.full(len(df), np.nan, dtype=np.float32)
+        return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float32)
+
+    city_codes, cities = _encode_strings(df['City'])
+    bucket_codes, buckets = _encode_strings(df['AQI_Bucket'] if 'AQI_Bucket' in df.columns
+                                            else pd.Series([None] * len(df), dtype=object))
+
+    dates = pd.to_datetime(df['Date'], errors='coerce')
+    date_values = dates.to_numpy(dtype='datetime64[ns]').view(np.int64).copy()
+    date_values[dates.isna().to_numpy()] = NAT
+
+    arrays = {
+        'city': city_codes,
+        'date': date_values,
+        'AQI': numeric('AQI'),
+        'AQI_Bucket': bucket_codes
+    }
+    for column in POLLUTANT_COLUMNS:
+        arrays[column] = numeric(column)
+
+    return arrays, {'city': cities, 'AQI_Bucket': buckets}
+
+def build_sidecar(path, source_hash=None):
+    """
+    Parse `path` and write its columnar sidecar, returning the sidecar directory
+    """
+    if source_hash is None:
+        source_hash = _file_hash(path)
+
+    arrays, categories = parse_csv_columns(path)
+    target = sidecar_path(path, source_hash)
+    tmp = f"{target}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    files = {}
+    for index, (name, values) in enumerate(arrays.items()):
+        filename = f"col{index}.npy"
+        np.save(os.path.join(tmp, filename), values)
+        files[name] = filename
+
+    manifest = {
+        'format': CACHE_FORMAT_VERSION,
+        'source_hash': source_hash,
+        'rows': int(len(arrays['date'])),
+        'files': files,
+        'categories': categories
+    }
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    # Publish in one rename; a concurrent builder may have beaten us to it
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    _remove_stale_sidecars(path, target)
+    return target
+
+def _remove_stale_sidecars(path, keep):
+    for stale in glob.glob(f"{glob.escape(path)}.*.cols"):
+        if stale != keep:
+            shutil.rmtree(stale, ignore_errors=True)
+
+def open_sidecar(directory):
+    """
+    Memory-map the columns of a sidecar; returns None if it is missing or invalid
+    """
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('format') != CACHE_FORMAT_VERSION:
+        return None
+
+    arrays = {}
+    for name, filename in manifest['files'].items():
+        arrays[name] = np.load(os.path.join(directory, filename), mmap_mode='r')
+    return arrays, manifest['categories']
+
+def load_columns(path):
+    """
+    Get the typed columns of `path`, from its sidecar when it is up to date,
+    otherwise by parsing the CSV and refreshing the sidecar
+    """
+    source_hash = _file_hash(path)
+    cached = open_sidecar(sidecar_path(path, source_hash))
+    if cached is not None:
+        return cached
+
+    try:
+        return open_sidecar(build_sidecar(path, source_hash)) or parse_csv_columns(path)
+    except OSError as e:
+        # Read-only data directory: fall back to parsing in memory
+        print(f"Unable to write dataset cache: {e}")
+        return parse_csv_columns(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the columnar cache of the AQI dataset')
+    parser.add_argument('path', nargs='?', default='data/aqi_data.csv')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    directory = build_sidecar(args.path)
+    print(f"Built {directory} in {time.perf_counter() - started:.2f}s")
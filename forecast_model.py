@@ -1,72 +1,509 @@
-import pandas as pd
+import threading
+import time
 import numpy as np
-import random
-from datetime import datetime, timedelta
+from cache_utils import LRUCache
+from city_index import get_city_index, normalize_city_key
+from data_store import get_data_store
 
-def forecast_aqi(location):
+# Longest horizon precomputed for every city at fit time
+MAX_HORIZON = 30
+
+SEASON_LENGTH = 7
+
+# Candidate smoothing parameters, searched jointly for all cities
+ALPHAS = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+BETAS = np.array([0.0, 0.05, 0.1, 0.2])
+GAMMA = 0.05
+PHI = 0.9
+
+# Observations used to settle the state before errors count towards the fit
+WARMUP_OBSERVATIONS = 30
+
+# One-step residuals kept per city for uncertainty estimates
+RESIDUAL_WINDOW = 365
+
+# Bootstrap paths simulated per city for prediction intervals; the seed is
+# fixed so intervals are reproducible and cacheable
+BOOTSTRAP_PATHS = 500
+BOOTSTRAP_SEED = 0
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+
+def build_series_matrix(index):
+    """
+    Lay the AQI of every city on a shared daily grid: returns the city keys,
+    the first grid date and a (cities x days) matrix with NaN for gaps
+    """
+    keys = list(index.ranges.keys())
+    frame = index.frame
+    if not keys:
+        return keys, None, np.empty((0, 0))
+
+    day = frame['date'].to_numpy().astype('datetime64[D]')
+    first_day = day.min()
+    offsets = (day - first_day).astype(np.int64)
+
+    lengths = [stop - start for start, stop in index.ranges.values()]
+    city_ids = np.repeat(np.arange(len(keys)), lengths)
+
+    matrix = np.full((len(keys), int(offsets.max()) + 1), np.nan)
+    matrix[city_ids, offsets] = frame['aqi'].to_numpy(dtype=np.float64)
+    return keys, first_day, matrix
+
+def fit_series(matrix, first_day):
+    """
+    Fit a damped-trend additive Holt-Winters model with weekly seasonality
+    to every row of `matrix` at once.
+
+    The smoothing recursion runs once over the time axis with the state of
+    all cities and all candidate (alpha, beta) pairs held in arrays; each
+    city keeps the pair with the lowest one-step squared error. Missing
+    days leave the state untouched.
+    """
+    n_cities, n_days = matrix.shape
+    alpha = np.repeat(ALPHAS, len(BETAS))[None, :]
+    beta = np.tile(BETAS, len(ALPHAS))[None, :]
+    n_candidates = alpha.shape[1]
+    shape = (n_cities, n_candidates)
+
+    level = np.zeros(shape)
+    trend = np.zeros(shape)
+    season = np.zeros(shape + (SEASON_LENGTH,))
+    seen = np.zeros(n_cities, dtype=np.int64)
+    sse = np.zeros(shape)
+    residuals = np.full(shape + (RESIDUAL_WINDOW,), np.nan)
+    last_day = np.full(n_cities, -1, dtype=np.int64)
+
+    first_weekday = (int(first_day.astype('datetime64[D]').astype(np.int64)) + 3) % SEASON_LENGTH
+    for t in range(n_days):
+        y = matrix[:, t]
+        observed = ~np.isnan(y)
+        if not observed.any():
+            continue
+
+        weekday = (first_weekday + t) % SEASON_LENGTH
+        starting = observed & (seen == 0)
+        updating = observed & (seen > 0)
+
+        # The first observation of a city initializes its level
+        level[starting] = y[starting, None]
+
+        if updating.any():
+            s = season[updating, :, weekday]
+            prediction = level[updating] + PHI * trend[updating] + s
+            error = y[updating, None] - prediction
+
+            level[updating] = level[updating] + PHI * trend[updating] + alpha * error
+            trend[updating] = PHI * trend[updating] + alpha * beta * error
+            season[updating, :, weekday] = s + GAMMA * error
+
+            settled = seen[updating] >= WARMUP_OBSERVATIONS
+            sse[updating] += np.where(settled[:, None], error ** 2, 0.0)
+            # Ring buffer of each city's latest one-step errors
+            slot = seen[updating] % RESIDUAL_WINDOW
+            residuals[np.flatnonzero(updating)[:, None], np.arange(n_candidates)[None, :], slot[:, None]] = error
+
+        seen[observed] += 1
+        last_day[observed] = t
+
+    best = sse.argmin(axis=1)
+    rows = np.arange(n_cities)
+
+    return {
+        'alpha': alpha[0, best],
+        'beta': beta[0, best],
+        'level': level[rows, best],
+        'trend': trend[rows, best],
+        'season': season[rows, best],
+        'residuals': residuals[rows, best],
+        'observations': seen,
+        'last_day': last_day,
+        'first_day': first_day.astype('datetime64[D]'),
+        'first_weekday': first_weekday
+    }
+
+def predict(params, horizon=MAX_HORIZON):
+    """
+    Point forecasts for days 1..horizon after each city's last observation,
+    as a (cities x horizon) matrix clipped to the AQI scale
+    """
+    steps = np.arange(1, horizon + 1)
+    damping = np.cumsum(PHI ** steps)
+    weekday = (params['first_weekday'] + params['last_day'][:, None] + steps[None, :]) % SEASON_LENGTH
+    seasonal = np.take_along_axis(params['season'], weekday, axis=1)
+
+    forecast = params['level'][:, None] + damping[None, :] * params['trend'][:, None] + seasonal
+    return np.clip(forecast, 0, 500)
+
+def simulate_paths(params, horizon=MAX_HORIZON, n_paths=BOOTSTRAP_PATHS, seed=BOOTSTRAP_SEED):
+    """
+    Bootstrap future paths for all cities at once by feeding resampled
+    one-step residuals through each city's fitted recursion. Returns a
+    (cities x paths x horizon) float32 array, not clipped to the AQI scale
+    so the spread around the median is kept intact.
+    """
+    rng = np.random.default_rng(seed)
+    n_cities = len(params['level'])
+
+    # Move each city's available residuals to the front of its pool,
+    # centered so the simulated paths do not drift away from the point forecast
+    pool = np.sort(params['residuals'], axis=1)
+    available = (~np.isnan(pool)).sum(axis=1)
+    pool = np.nan_to_num(pool, nan=0.0)
+    mean = pool.sum(axis=1) / np.maximum(available, 1)
+    pool = np.where(np.arange(pool.shape[1])[None, :] < available[:, None], pool - mean[:, None], 0.0)
+
+    alpha = params['alpha'][:, None]
+    beta = params['beta'][:, None]
+    level = np.repeat(params['level'][:, None], n_paths, axis=1)
+    trend = np.repeat(params['trend'][:, None], n_paths, axis=1)
+    season = np.repeat(params['season'][:, None, :], n_paths, axis=1)
+    rows = np.arange(n_cities)[:, None]
+
+    paths = np.empty((n_cities, n_paths, horizon), dtype=np.float32)
+    for step in range(horizon):
+        weekday = (params['first_weekday'] + params['last_day'] + step + 1) % SEASON_LENGTH
+        s = season[rows, np.arange(n_paths)[None, :], weekday[:, None]]
+
+        draw = (rng.random((n_cities, n_paths)) * np.maximum(available, 1)[:, None]).astype(np.int64)
+        error = np.where(available[:, None] > 0, pool[rows, draw], 0.0)
+
+        paths[:, :, step] = level + PHI * trend + s + error
+
+        level = level + PHI * trend + alpha * error
+        trend = PHI * trend + alpha * beta * error
+        season[rows, np.arange(n_paths)[None, :], weekday[:, None]] = s + GAMMA * error
+
+    return paths
+
+def quantile_label(q):
+    """
+    Key of a quantile in forecast entries, e.g. 0.1 -> 'p10'
+    """
+    return f"p{q * 100:g}"
+
+# Per-city entries of the fitted parameters; the rest are shared scalars
+CITY_PARAMS = ['alpha', 'beta', 'level', 'trend', 'season', 'residuals', 'observations',
+               'last_day', 'rows', 'checksum']
+
+def _select_cities(params, rows):
+    return dict(params, **{name: params[name][rows] for name in CITY_PARAMS})
+
+def update_state(params, i, day, value):
+    """
+    Advance city `i` by one observation with its fitted smoothing
+    parameters, exactly as fit_series would have: O(1) per observation
+    """
+    if params['observations'][i] == 0:
+        params['level'][i] = value
+    else:
+        weekday = (params['first_weekday'] + day) % SEASON_LENGTH
+        s = params['season'][i, weekday]
+        error = value - (params['level'][i] + PHI * params['trend'][i] + s)
+
+        alpha = params['alpha'][i]
+        params['level'][i] += PHI * params['trend'][i] + alpha * error
+        params['trend'][i] = PHI * params['trend'][i] + alpha * params['beta'][i] * error
+        params['season'][i, weekday] = s + GAMMA * error
+        params['residuals'][i, params['observations'][i] % RESIDUAL_WINDOW] = error
+
+    params['observations'][i] += 1
+    params['last_day'][i] = day
+
+class ForecastModel:
     """
-    Simplified forecast function that provides 3-day AQI predictions
+    Fitted forecasting state of every city for one dataset version, with
+    the forecasts up to MAX_HORIZON precomputed so serving is a lookup
     """
+    def __init__(self, keys, names, params, fit_seconds, version=None, forecasts=None):
+        self.key_list = list(keys)
+        self.keys = {key: i for i, key in enumerate(keys)}
+        self.names = names
+        self.params = params
+        self.fit_seconds = fit_seconds
+        self.version = version
+        if forecasts is None:
+            forecasts = predict(params) if keys else np.empty((0, MAX_HORIZON))
+        self.forecasts = forecasts
+        self.last_dates = params['first_day'] + params['last_day'] if keys else np.array([], dtype='datetime64[D]')
+        self._paths = None
+        self._quantiles = LRUCache(max_entries=32)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fit(cls, snapshot):
+        started = time.perf_counter()
+        index = get_city_index(snapshot)
+        keys, first_day, matrix = build_series_matrix(index)
+        names = [str(index.frame['city'].iat[start]) for start, _ in index.ranges.values()]
+        params = {}
+        if keys:
+            params = fit_series(matrix, first_day)
+
+            # Row count and AQI sum of each city let later updates tell
+            # appended rows apart from rewritten history
+            starts = np.array([start for start, _ in index.ranges.values()])
+            params['rows'] = np.diff(np.r_[starts, len(index.frame)])
+            params['checksum'] = np.add.reduceat(index.frame['aqi'].to_numpy(dtype=np.float64), starts)
+        return cls(keys, names, params, time.perf_counter() - started, snapshot.version)
+
+    def updated(self, snapshot):
+        """
+        Bring the model up to `snapshot` without refitting everything.
+
+        Cities that only gained rows after their last observation are
+        advanced in O(1) per new row; cities whose earlier rows changed, and
+        new cities, are refitted on their own; untouched cities are kept.
+        """
+        index = get_city_index(snapshot)
+        if not self.key_list or any(key not in index.ranges for key in self.key_list):
+            return ForecastModel.fit(snapshot)
+
+        started = time.perf_counter()
+        params = {name: (value.copy() if isinstance(value, np.ndarray) else value)
+                  for name, value in self.params.items()}
+        keys = list(self.key_list)
+        names = list(self.names)
+        first_day = params['first_day']
+        days_all = (index.frame['date'].to_numpy().astype('datetime64[D]') - first_day).astype(np.int64)
+        aqi_all = index.frame['aqi'].to_numpy(dtype=np.float64)
+
+        changed = []
+        for key, (start, stop) in index.ranges.items():
+            days = days_all[start:stop]
+            values = aqi_all[start:stop]
+            if len(days) and days[0] < 0:
+                # History now starts before the model's grid
+                return ForecastModel.fit(snapshot)
+
+            i = self.keys.get(key)
+            if i is not None:
+                known = int(np.searchsorted(days, params['last_day'][i], side='right'))
+                unchanged = known == params['rows'][i] and np.isclose(values[:known].sum(), params['checksum'][i])
+                if unchanged:
+                    for day, value in zip(days[known:], values[known:]):
+                        update_state(params, i, int(day), value)
+                    if known < len(days):
+                        params['rows'][i] = len(days)
+                        params['checksum'][i] = values.sum()
+                        changed.append(i)
+                    continue
+
+            # Refit this city alone on the shared grid
+            row = np.full(int(days[-1]) + 1, np.nan)
+            row[days] = values
+            city = fit_series(row[None, :], first_day)
+            city['rows'] = np.array([len(days)])
+            city['checksum'] = np.array([values.sum()])
+            if i is None:
+                i = len(keys)
+                keys.append(key)
+                names.append(str(index.frame['city'].iat[start]))
+                for name in CITY_PARAMS:
+                    params[name] = np.concatenate([params[name], city[name]])
+            else:
+                for name in CITY_PARAMS:
+                    params[name][i] = city[name][0]
+            changed.append(i)
+
+        forecasts = self.forecasts
+        if changed:
+            forecasts = np.concatenate([forecasts, np.empty((len(keys) - len(forecasts), MAX_HORIZON))])
+            forecasts[changed] = predict(_select_cities(params, changed))
+
+        return ForecastModel(keys, names, params, time.perf_counter() - started, snapshot.version, forecasts)
+
+    def quantiles(self, quantiles):
+        """
+        (quantiles x cities x MAX_HORIZON) matrix of forecast quantiles,
+        computed from the bootstrap paths once per set of quantiles.
+
+        Bands are anchored on the point forecast: each quantile is the point
+        forecast plus that quantile's offset from the paths' median, so p50
+        is the point forecast and skewed residuals only widen one side.
+        """
+        def compute():
+            with self._lock:
+                if self._paths is None:
+                    self._paths = simulate_paths(self.params)
+            offsets = np.quantile(self._paths, (0.5,) + tuple(quantiles), axis=1)
+            bands = self.forecasts[None, :, :] + offsets[1:] - offsets[:1]
+            return np.clip(bands, 0, 500)
+
+        return self._quantiles.get_or_compute(tuple(quantiles), compute)
+
+    def forecast_batch(self, locations=None, horizon=3, quantiles=DEFAULT_QUANTILES):
+        """
+        Forecast entries for many cities in one pass, as a dict keyed by
+        city name, plus the requested locations that have no model.
+        `locations=None` forecasts every city.
+        """
+        if locations is None:
+            rows = [i for i in range(len(self.names)) if self.params['observations'][i] > 0]
+            missing = []
+        else:
+            rows, missing = [], []
+            for location in locations:
+                i = self.keys.get(normalize_city_key(location))
+                if i is None or self.params['observations'][i] == 0:
+                    missing.append(location)
+                elif i not in rows:
+                    rows.append(i)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        steps = np.arange(1, horizon + 1)
+        dates = (self.last_dates[rows][:, None] + steps[None, :]).astype(str).tolist()
+        points = np.round(self.forecasts[rows, :horizon], 1).tolist()
+        if quantiles:
+            bands = np.round(self.quantiles(quantiles)[:, rows, :horizon], 1).tolist()
+            labels = [quantile_label(q) for q in quantiles]
+
+        forecasts = {}
+        for n, i in enumerate(rows):
+            entries = []
+            for step in range(horizon):
+                entry = {'date': dates[n][step], 'aqi': points[n][step]}
+                if quantiles:
+                    entry['quantiles'] = {label: bands[j][n][step] for j, label in enumerate(labels)}
+                entries.append(entry)
+            forecasts[self.names[i]] = entries
+
+        return forecasts, missing
+
+    def forecast(self, location, horizon=3, quantiles=DEFAULT_QUANTILES):
+        """
+        Forecast entries for a city, or None if the city has no fitted model
+        """
+        forecasts, _ = self.forecast_batch([location], horizon, quantiles)
+        return next(iter(forecasts.values()), None)
+
+# Seconds between background full refits
+FULL_REFIT_INTERVAL = 6 * 3600
+
+class ForecastModelStore:
+    """
+    Owner of the served forecast model.
+
+    When the dataset changes, the model is brought up to date incrementally
+    (see ForecastModel.updated). A background thread periodically refits
+    every city from scratch and swaps the result in with one assignment, so
+    /forecast never waits for a full refit.
+    """
+    def __init__(self, refit_interval=FULL_REFIT_INTERVAL):
+        self.refit_interval = refit_interval
+        self._model = None
+        self._update_lock = threading.Lock()
+        self.refit_active = False
+        self.refit_thread = None
+
+    def get_model(self):
+        """
+        Get the model for the current dataset version
+        """
+        snapshot = get_data_store().snapshot()
+        model = self._model
+        if model is not None and model.version == snapshot.version:
+            return model
+
+        with self._update_lock:
+            model = self._model
+            if model is None:
+                model = ForecastModel.fit(snapshot)
+            elif model.version != snapshot.version:
+                model = model.updated(snapshot)
+            self._model = model
+
+        self.start_refitting()
+        return model
+
+    def start_refitting(self):
+        """
+        Start the background full-refit thread
+        """
+        if not self.refit_active:
+            self.refit_active = True
+            self.refit_thread = threading.Thread(target=self._refit_periodically)
+            self.refit_thread.daemon = True
+            self.refit_thread.start()
+
+    def stop_refitting(self):
+        """
+        Stop the background full refits
+        """
+        self.refit_active = False
+
+    def refit(self):
+        """
+        Refit every city from scratch and swap the result in
+        """
+        snapshot = get_data_store().snapshot()
+        model = ForecastModel.fit(snapshot)
+
+        with self._update_lock:
+            current = self._model
+            # A newer incremental model is caught up again on next access
+            if current is None or current.version <= model.version:
+                self._model = model
+        return model
+
+    def _refit_periodically(self):
+        while self.refit_active:
+            time.sleep(self.refit_interval)
+            try:
+                self.refit()
+            except Exception as e:
+                print(f"Error refitting forecast model: {e}")
+
+# Global forecast model store instance
+forecast_model_store = ForecastModelStore()
+
+def get_forecast_model():
+    """
+    Get the forecast model for the current dataset version
+    """
+    return forecast_model_store.get_model()
+
+def parse_horizon(value, default=3):
+    """
+    Validate a requested forecast horizon in days
+    """
+    if value is None:
+        return default
+    try:
+        horizon = int(value)
+        exact = not isinstance(value, bool) and horizon == float(value)
+    except (TypeError, ValueError, OverflowError):
+        exact = False
+    if not exact:
+        raise ValueError('horizon must be an integer')
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise ValueError(f"horizon must be between 1 and {MAX_HORIZON} days")
+    return horizon
+
+def parse_quantiles(values):
+    """
+    Validate requested quantiles, returning them as a sorted tuple
+    """
+    if values is None:
+        return DEFAULT_QUANTILES
     try:
-        # Load and normalize dataset
-        df = pd.read_csv('data/aqi_data.csv')
-        df.columns = df.columns.str.strip().str.lower()
-        
-        # Check required columns
-        if 'city' not in df.columns or 'aqi' not in df.columns or 'date' not in df.columns:
-            return generate_mock_forecast()
-        
-        # Filter by city
-        df = df[df['city'].str.lower() == location.lower()]
-        
-        if df.empty:
-            return generate_mock_forecast()
-        
-        # Sort and prepare AQI series
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['date'])
-        df = df.sort_values('date')
-        
-        # Only keep records with valid AQI values
-        df = df[df['aqi'].notna()]
-        
-        if df.empty:
-            return generate_mock_forecast()
-        
-        # Get recent average AQI
-        recent_aqi = df['aqi'].tail(10).mean()
-        last_date = df['date'].max()
-        
-        # Generate forecast based on recent trends
-        forecasts = []
-        for i in range(3):
-            # Add some randomness to simulate forecast uncertainty
-            forecast_aqi = max(0, min(500, recent_aqi + random.randint(-20, 20)))
-            next_date = last_date + pd.Timedelta(days=i+1)
-            
-            forecasts.append({
-                'date': str(next_date.date()),
-                'aqi': round(forecast_aqi, 1)
-            })
-        
-        return forecasts
-        
-    except Exception as e:
-        return generate_mock_forecast()
-
-def generate_mock_forecast():
-    """Generate mock forecast data when real data is unavailable"""
-    today = datetime.now()
-    base_aqi = random.randint(50, 150)
-    
-    forecast_data = []
-    for i in range(3):
-        forecast_date = today + timedelta(days=i+1)
-        aqi_value = max(0, base_aqi + random.randint(-20, 20))
-        
-        forecast_data.append({
-            'date': forecast_date.strftime('%Y-%m-%d'),
-            'aqi': aqi_value
-        })
-    
-    return forecast_data
+        quantiles = tuple(sorted({float(q) for q in values}))
+    except (TypeError, ValueError):
+        raise ValueError('quantiles must be a list of numbers')
+    if not quantiles or len(quantiles) > 9 or any(not 0 < q < 1 for q in quantiles):
+        raise ValueError('quantiles must be 1 to 9 values between 0 and 1')
+    return quantiles
+
+def forecast_aqi(location, quantiles=DEFAULT_QUANTILES, horizon=3):
+    """
+    Deterministic AQI forecast (3 days by default) from the batch-fitted
+    model, with prediction intervals at the given quantiles. Returns None
+    if the city has no fitted model.
+    """
+    return get_forecast_model().forecast(location, horizon, quantiles)
+
+def forecast_batch(locations=None, quantiles=DEFAULT_QUANTILES, horizon=3):
+    """
+    Forecasts for a list of cities, or all cities when `locations` is None
+    """
+    forecasts, missing = get_forecast_model().forecast_batch(locations, horizon, quantiles)
+    return {'forecasts': forecasts, 'missing': missing}
@@ -1,6 +1,8 @@
 import pandas as pd
+import numpy as np
 import json
-from utils import load_and_prepare_data
+from data_store import get_data_store
+from city_index import get_city_index, normalize_city_key
 
 def get_city_coordinates():
     """
@@ -110,90 +112,134 @@ def get_city_coordinates():
         'kurnool': {'lat': 15.8281, 'lng': 78.0373}
     }
 
-def get_latest_aqi_for_all_cities():
+def _heatmap_entries(latest):
     """
-    Get the latest AQI data for all cities in the dataset
+    Compute the city record and heatmap point of every latest row that has
+    coordinates, keyed by normalized city key, in one vectorized pass
     """
-    df = load_and_prepare_data()
-    city_coords = get_city_coordinates()
+    if latest.empty:
+        return {}
     
-    # Get the latest AQI for each city
-    latest_data = []
+    # Join coordinates, trying the compact key first like the original lookup
+    coords = pd.DataFrame.from_dict(get_city_coordinates(), orient='index')
+    city_lower = latest['city'].astype(str).str.lower()
+    compact_key = city_lower.str.replace(' ', '', regex=False).str.replace('-', '', regex=False)
+    lat = compact_key.map(coords['lat']).fillna(city_lower.map(coords['lat']))
+    lng = compact_key.map(coords['lng']).fillna(city_lower.map(coords['lng']))
     
-    for city in df['city'].unique():
-        city_data = df[df['city'].str.lower() == city.lower()]
-        if city_data.empty:
-            continue
-            
-        # Get latest record with valid AQI
-        city_with_aqi = city_data[city_data['aqi'].notna()]
-        if city_with_aqi.empty:
-            continue
-            
-        latest_record = city_with_aqi.sort_values('date', ascending=False).iloc[0]
-        
-        # Get coordinates
-        city_key = city.lower().replace(' ', '').replace('-', '')
-        coords = city_coords.get(city_key, city_coords.get(city.lower()))
-        
-        if coords:
-            latest_data.append({
-                'city': city,
-                'aqi': float(latest_record['aqi']),
-                'aqi_bucket': latest_record.get('aqi_bucket', 'Unknown'),
-                'date': latest_record['date'].strftime('%Y-%m-%d'),
-                'lat': coords['lat'],
-                'lng': coords['lng']
-            })
+    has_coords = lat.notna().to_numpy()
+    aqi = latest['aqi'].to_numpy(dtype=float)[has_coords]
+    if 'aqi_bucket' in latest.columns:
+        buckets = latest['aqi_bucket'].astype(object).where(latest['aqi_bucket'].notna(), 'Unknown')
+    else:
+        buckets = pd.Series('Unknown', index=latest.index)
     
-    return latest_data
-
-def generate_heatmap_data():
-    """
-    Generate heatmap data in the format required for visualization
-    """
-    cities_data = get_latest_aqi_for_all_cities()
+    cities = latest['city'].to_numpy()[has_coords]
+    dates = latest['date'].dt.strftime('%Y-%m-%d').to_numpy()[has_coords]
+    buckets = buckets.to_numpy()[has_coords]
+    lats = lat.to_numpy()[has_coords]
+    lngs = lng.to_numpy()[has_coords]
     
-    # Convert to format suitable for heatmap
-    heatmap_points = []
-    for city in cities_data:
-        # Normalize AQI for heatmap intensity (0-1 scale)
-        intensity = min(city['aqi'] / 500, 1.0)  # Cap at 500 AQI
-        
-        heatmap_points.append({
-            'lat': city['lat'],
-            'lng': city['lng'],
-            'intensity': intensity,
-            'city': city['city'],
-            'aqi': city['aqi'],
-            'category': city['aqi_bucket'],
-            'date': city['date']
-        })
+    # Normalize AQI for heatmap intensity (0-1 scale), capped at 500 AQI
+    intensity = np.minimum(aqi / 500, 1.0)
+    
+    entries = {}
+    for i in range(len(cities)):
+        city_data = {
+            'city': cities[i],
+            'aqi': float(aqi[i]),
+            'aqi_bucket': buckets[i],
+            'date': dates[i],
+            'lat': float(lats[i]),
+            'lng': float(lngs[i])
+        }
+        point = {
+            'lat': float(lats[i]),
+            'lng': float(lngs[i]),
+            'intensity': float(intensity[i]),
+            'city': cities[i],
+            'aqi': float(aqi[i]),
+            'category': buckets[i],
+            'date': dates[i]
+        }
+        entries[normalize_city_key(cities[i])] = (city_data, point)
     
-    return heatmap_points
+    return entries
 
-def get_aqi_statistics():
+def _build_heatmap_snapshot(snapshot):
     """
-    Generate statistics for the dashboard
+    Compute the latest record of every city, the heatmap points and the
+    statistics from the city index. After an append only the cities that
+    received rows are recomputed; the others come from the parent snapshot.
     """
-    cities_data = get_latest_aqi_for_all_cities()
+    latest = get_city_index(snapshot).latest_rows
+    
+    parent = snapshot.parent.peek('heatmap') if snapshot.parent is not None else None
+    if parent is not None and snapshot.changed_keys is not None and not latest.empty:
+        keys = latest['city'].astype(str).str.strip().str.lower()
+        changed = keys.isin(snapshot.changed_keys).to_numpy()
+        updates = _heatmap_entries(latest[changed])
+        entries = {}
+        for key in keys:
+            if key in updates:
+                entries[key] = updates[key]
+            elif key in parent['entries']:
+                entries[key] = parent['entries'][key]
+    else:
+        entries = _heatmap_entries(latest)
+    
+    cities_data = [city_data for city_data, _ in entries.values()]
+    heatmap_points = [point for _, point in entries.values()]
     
     if not cities_data:
-        return {
-            'total_cities': 0,
-            'avg_aqi': 0,
-            'max_aqi': 0,
-            'min_aqi': 0,
-            'unhealthy_cities': 0
+        statistics = _empty_statistics()
+    else:
+        aqi = np.array([city_data['aqi'] for city_data in cities_data])
+        statistics = {
+            'total_cities': len(cities_data),
+            'avg_aqi': round(float(aqi.mean()), 2),
+            'max_aqi': float(aqi.max()),
+            'min_aqi': float(aqi.min()),
+            'unhealthy_cities': int((aqi > 100).sum()),
+            'cities_data': cities_data
         }
     
-    aqi_values = [city['aqi'] for city in cities_data]
-    
     return {
-        'total_cities': len(cities_data),
-        'avg_aqi': round(sum(aqi_values) / len(aqi_values), 2),
-        'max_aqi': max(aqi_values),
-        'min_aqi': min(aqi_values),
-        'unhealthy_cities': len([aqi for aqi in aqi_values if aqi > 100]),
-        'cities_data': cities_data
+        'cities_data': cities_data,
+        'heatmap_points': heatmap_points,
+        'statistics': statistics,
+        'entries': entries
+    }
+
+def _empty_statistics():
+    return {
+        'total_cities': 0,
+        'avg_aqi': 0,
+        'max_aqi': 0,
+        'min_aqi': 0,
+        'unhealthy_cities': 0
     }
+
+def _get_heatmap_snapshot():
+    """
+    Get the heatmap results shared by all callers of the current dataset version
+    """
+    return get_data_store().snapshot().derived('heatmap', _build_heatmap_snapshot)
+
+def get_latest_aqi_for_all_cities():
+    """
+    Get the latest AQI data for all cities in the dataset
+    """
+    return _get_heatmap_snapshot()['cities_data']
+
+def generate_heatmap_data():
+    """
+    Generate heatmap data in the format required for visualization
+    """
+    return _get_heatmap_snapshot()['heatmap_points']
+
+def get_aqi_statistics():
+    """
+    Generate statistics for the dashboard
+    """
+    return _get_heatmap_snapshot()['statistics']
@@ -0,0 +1,259 @@
+import json
+import numpy as np
+import pandas as pd
+from cache_utils import LRUCache
+from city_index import get_city_index, frame_to_records, normalize_city_key
+from data_store import get_data_store
+from partition_store import get_partition_store
+
+# Rows serialized per chunk when streaming a history response
+STREAM_CHUNK_ROWS = 500
+
+# Streamed timestamps keep the time of day, in the same ISO form as cursors
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def _parse_date(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return pd.Timestamp(value).to_datetime64()
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name} date: {value}")
+
+def _parse_cursor(cursor):
+    """
+    Split a cursor into (timestamp, rows at that timestamp already returned)
+    """
+    if cursor in (None, ''):
+        return None, 0
+    value, _, skip = str(cursor).partition('@')
+    try:
+        skip = int(skip) if skip else 0
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if skip < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return _parse_date(value, 'cursor'), skip
+
+def _format_cursor(dates, position, first):
+    """
+    Cursor of the row at `position` of the date-sorted `dates`; `first` is
+    the position of the first row with the same timestamp. The timestamp is
+    kept at full precision and the rows already returned at that timestamp
+    are counted, so pages of sub-daily rows always advance.
+    """
+    cursor = pd.Timestamp(dates[position]).isoformat()
+    skip = position - first
+    return f"{cursor}@{skip}" if skip else cursor
+
+def query_history(location, start=None, end=None, limit=None, cursor=None, index=None):
+    """
+    Get a city's rows between `start` and `end` (inclusive), at most `limit`
+    of them starting from `cursor`.
+
+    The city's rows are already date-sorted, so the range is found by binary
+    search and returned as a slice. Returns (rows, next_cursor), where
+    next_cursor is None once the range is exhausted.
+
+    When a partition store is configured and no index is given, the rows
+    are read from the partitions overlapping the range instead.
+    """
+    start = _parse_date(start, 'start')
+    end = _parse_date(end, 'end')
+    cursor, skip = _parse_cursor(cursor)
+    # Rows at the cursor timestamp are only skipped when the page starts there
+    if cursor is not None and start is not None and start > cursor:
+        skip = 0
+    if limit is not None:
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError('limit must be positive')
+
+    partitions = get_partition_store() if index is None else None
+    if partitions is not None:
+        return _query_partitions(partitions, location, start, end, limit, cursor, skip)
+
+    if index is None:
+        index = get_city_index()
+    if not index.has_city(location):
+        return pd.DataFrame(), None
+
+    rows = index.get_rows(location)
+    dates = rows['date'].to_numpy()
+
+    lo = 0 if start is None else int(np.searchsorted(dates, start, side='left'))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, end, side='right'))
+    if cursor is not None:
+        lo = max(lo, int(np.searchsorted(dates, cursor, side='left')) + skip)
+    hi = max(lo, hi)
+
+    stop = hi if limit is None else min(hi, lo + limit)
+
+    next_cursor = None
+    if stop < hi:
+        first = int(np.searchsorted(dates, dates[stop], side='left'))
+        next_cursor = _format_cursor(dates, stop, first)
+
+    return rows.iloc[lo:stop], next_cursor
+
+def _query_partitions(partitions, location, start, end, limit, cursor, skip=0):
+    if not partitions.has_city(location):
+        return pd.DataFrame(), None
+
+    if cursor is not None:
+        start = cursor if start is None else max(start, cursor)
+    else:
+        skip = 0
+
+    # The read starts at the cursor timestamp, so the rows already returned
+    # at that timestamp come first; one extra row tells whether another page follows
+    rows = partitions.read_range(location, start, end, limit=None if limit is None else skip + limit + 1)
+    dates = rows['date'].to_numpy() if not rows.empty else np.empty(0, dtype='datetime64[ns]')
+    if skip:
+        skip = min(skip, int(np.searchsorted(dates, start, side='right')))
+
+    next_cursor = None
+    if limit is not None and len(rows) > skip + limit:
+        stop = skip + limit
+        first = int(np.searchsorted(dates, dates[stop], side='left'))
+        next_cursor = _format_cursor(dates, stop, first)
+        rows = rows.iloc[skip:stop]
+    else:
+        rows = rows.iloc[skip:]
+
+    return rows, next_cursor
+
+def _chunk_records(rows):
+    for offset in range(0, len(rows), STREAM_CHUNK_ROWS):
+        chunk = rows.iloc[offset:offset + STREAM_CHUNK_ROWS]
+        chunk = chunk.assign(**{
+            column: chunk[column].dt.strftime(TIMESTAMP_FORMAT)
+            for column in chunk.columns if pd.api.types.is_datetime64_any_dtype(chunk[column])
+        })
+        yield frame_to_records(chunk)
+
+def iter_ndjson(rows):
+    """
+    Stream rows as newline-delimited JSON, one chunk of lines at a time
+    """
+    for records in _chunk_records(rows):
+        yield ''.join(json.dumps(record) + '\n' for record in records)
+
+def iter_columnar_json(rows, next_cursor=None):
+    """
+    Stream rows as one JSON object holding an array per column, emitting
+    each column in chunks so no full copy of the range is built
+    """
+    yield '{"next_cursor": ' + json.dumps(next_cursor) + ', "rows": ' + str(len(rows)) + ', "columns": {'
+
+    for i, column in enumerate(rows.columns):
+        if i:
+            yield ', '
+        yield json.dumps(str(column)) + ': ['
+        for offset in range(0, len(rows), STREAM_CHUNK_ROWS):
+            chunk = rows[[column]].iloc[offset:offset + STREAM_CHUNK_ROWS]
+            if pd.api.types.is_datetime64_any_dtype(chunk[column]):
+                chunk = chunk.assign(**{column: chunk[column].dt.strftime(TIMESTAMP_FORMAT)})
+            values = [record[column] for record in frame_to_records(chunk)]
+            yield (', ' if offset else '') + json.dumps(values)[1:-1]
+        yield ']'
+
+    yield '}}'
+
+def lttb_indices(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets: positions of `points` samples that keep
+    the visual shape of the series. The first and last samples are always
+    kept; each bucket in between keeps the sample forming the largest
+    triangle with the previous pick and the mean of the next bucket.
+    """
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket boundaries over the interior samples, and each bucket's mean
+    edges = (np.floor(np.arange(points - 1) * (n - 2) / (points - 2)) + 1).astype(np.int64)
+    edges[-1] = n - 1
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+
+    # The bucket after the last one is the final sample itself
+    next_x = np.r_[mean_x[1:], x[-1]]
+    next_y = np.r_[mean_y[1:], y[-1]]
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[previous] - next_x[i]) * (y[lo:hi] - y[previous])
+                      - (x[previous] - x[lo:hi]) * (next_y[i] - y[previous]))
+        previous = lo + int(area.argmax())
+        selected[i + 1] = previous
+
+    return selected
+
+def minmax_indices(y, points):
+    """
+    Min/max-per-bucket: positions of the first and last sample plus the
+    lowest and highest sample of each equal-width bucket, in series order
+    """
+    n = len(y)
+    if points >= n or points < 4:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    buckets = (points - 2) // 2
+    bucket_of = np.arange(n) * buckets // n
+
+    # Sort by (bucket, value): each bucket's first entry is its minimum and
+    # its last entry its maximum
+    order = np.lexsort((y, bucket_of))
+    starts = np.searchsorted(bucket_of[order], np.arange(buckets), side='left')
+    stops = np.r_[starts[1:], n] - 1
+
+    return np.unique(np.r_[0, order[starts], order[stops], n - 1])
+
+def _lttb_rows(rows, points):
+    return lttb_indices(rows['date'].to_numpy().view(np.int64), rows['aqi'].to_numpy(), points)
+
+def _minmax_rows(rows, points):
+    return minmax_indices(rows['aqi'].to_numpy(), points)
+
+DOWNSAMPLE_METHODS = {
+    'lttb': _lttb_rows,
+    'minmax': _minmax_rows
+}
+
+def _downsample_cache(snapshot):
+    return LRUCache(max_entries=512)
+
+def downsample_history(location, points, start=None, end=None, method='lttb'):
+    """
+    Get at most `points` rows of a city's history in the given range,
+    chosen to preserve the shape of the AQI series.
+
+    The selected positions are cached per (city, points, range, method) for
+    the current dataset version.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    points = int(points)
+    if points < 4:
+        raise ValueError('points must be at least 4')
+
+    snapshot = get_data_store().snapshot()
+    rows, _ = query_history(location, start=start, end=end, index=get_city_index(snapshot))
+    if rows.empty:
+        return rows
+
+    cache = snapshot.derived('downsample_cache', _downsample_cache)
+    key = (normalize_city_key(location), points, str(start), str(end), method)
+    positions = cache.get_or_compute(key, lambda: DOWNSAMPLE_METHODS[method](rows, points))
+
+    return rows.iloc[positions]
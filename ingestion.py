@@ -0,0 +1,289 @@
+import argparse
+import csv
+import math
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from dataset_cache import POLLUTANT_COLUMNS
+from data_store import get_data_store
+from partition_store import get_partition_store
+from pollutants import CPCB_BREAKPOINTS, compute_aqi
+
+# Columns of an ingested reading, in the CSV schema
+READING_COLUMNS = ['City', 'Date'] + POLLUTANT_COLUMNS + ['AQI', 'AQI_Bucket']
+
+# Readings above this are treated as sensor errors
+MAX_READING = 10000
+
+_COLUMN_LOOKUP = {column.lower(): column for column in READING_COLUMNS}
+
+def validate_reading(reading):
+    """
+    Validate one reading given as a dict in the CSV schema (keys are matched
+    case-insensitively). Returns (row, None) or (None, error message).
+    """
+    if not isinstance(reading, dict):
+        return None, 'reading must be an object'
+
+    row = dict.fromkeys(READING_COLUMNS)
+    for key, value in reading.items():
+        column = _COLUMN_LOOKUP.get(str(key).strip().lower())
+        if column is None:
+            return None, f"unknown field: {key}"
+        row[column] = value
+
+    city = row['City']
+    if not isinstance(city, str) or not city.strip():
+        return None, 'City is required'
+    row['City'] = city.strip()
+
+    date = pd.to_datetime(row['Date'], errors='coerce')
+    if row['Date'] is None or pd.isna(date):
+        return None, f"invalid Date: {row['Date']}"
+    row['Date'] = date.strftime('%Y-%m-%d')
+
+    measured = False
+    for column in POLLUTANT_COLUMNS + ['AQI']:
+        value = row[column]
+        if value is None or value == '':
+            row[column] = None
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None, f"{column} must be a number"
+        if math.isnan(value):
+            row[column] = None
+            continue
+        if value < 0 or value > MAX_READING:
+            return None, f"{column} out of range: {value}"
+        row[column] = value
+        measured = True
+
+    if not measured:
+        return None, 'at least one pollutant or AQI is required'
+
+    if row['AQI'] is None:
+        # Rows whose AQI cannot be derived are dropped by the load pipeline
+        readings = {name: np.array([row[name] if row[name] is not None else np.nan])
+                    for name in CPCB_BREAKPOINTS}
+        if np.isnan(compute_aqi(readings)[0][0]):
+            return None, 'AQI is missing and cannot be derived from the pollutants'
+
+    if row['AQI_Bucket'] is not None and not isinstance(row['AQI_Bucket'], str):
+        return None, 'AQI_Bucket must be a string'
+    if not row['AQI_Bucket']:
+        row['AQI_Bucket'] = None
+
+    return row, None
+
+class Ingestor:
+    """
+    Buffers validated readings and appends them to the dataset store in
+    batches, from a background thread that flushes when a batch is full or
+    `flush_interval` seconds have passed. The store's ingestion log is
+    folded into the CSV every `compact_interval` seconds.
+    """
+    def __init__(self, store=None, batch_size=500, flush_interval=2.0, compact_interval=3600):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_compact = time.monotonic()
+        self.accepted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.last_flush_ms = None
+
+    def _store(self):
+        return self.store if self.store is not None else get_data_store()
+
+    def submit(self, readings, flush=False):
+        """
+        Validate readings and queue the valid ones. With `flush`, the
+        readings are appended before returning. Raises RuntimeError when the
+        store is a read-only shared dataset.
+        """
+        # Refuse up front: queued readings could never be flushed
+        if self._store().is_shared():
+            raise RuntimeError('Cannot ingest into a shared dataset; ingest in a process without AQI_SHARED_DATASET_DIR')
+
+        rows = []
+        errors = []
+        for i, reading in enumerate(readings):
+            row, error = validate_reading(reading)
+            if error:
+                errors.append({'index': i, 'error': error})
+            else:
+                rows.append(row)
+
+        with self._lock:
+            self._pending.extend(rows)
+            self.accepted += len(rows)
+            self.rejected += len(errors)
+            pending = len(self._pending)
+
+        if flush:
+            self.flush()
+        else:
+            self.start()
+            if pending >= self.batch_size:
+                self._wakeup.set()
+
+        return {'accepted': len(rows), 'rejected': errors}
+
+    def flush(self):
+        """
+        Append every queued reading to the store in one batch
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                snapshot = self._store().append(pd.DataFrame(rows, columns=READING_COLUMNS))
+                partitions = get_partition_store()
+                if partitions is not None:
+                    partitions.ingest(snapshot.appended)
+            except Exception:
+                # Keep the rows for the next attempt
+                with self._lock:
+                    self._pending = rows + self._pending
+                raise
+            self.batches += 1
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+            return len(rows)
+
+    def compact(self):
+        """
+        Fold the ingestion log into the CSV
+        """
+        with self._flush_lock:
+            self._last_compact = time.monotonic()
+            return self._store().compact()
+
+    def start(self):
+        """
+        Start the background flushing thread
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_compact >= self.compact_interval:
+                    self.compact()
+            except Exception as e:
+                print(f"Error flushing ingested readings: {e}")
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'pending': pending,
+            'batches': self.batches,
+            'last_flush_ms': self.last_flush_ms
+        }
+
+class CsvTailIngestor:
+    """
+    Follows a CSV file in the dataset schema, like `tail -f`, and submits
+    every newly completed line to an ingestor
+    """
+    def __init__(self, path, ingestor, poll_interval=5.0, from_start=False):
+        self.path = path
+        self.ingestor = ingestor
+        self.poll_interval = poll_interval
+        self.header = None
+        self.offset = None if from_start else self._end_offset()
+        self._thread = None
+
+    def _end_offset(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return None
+
+    def poll(self):
+        """
+        Submit the lines appended since the last poll. Returns the ingestion summary.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return {'accepted': 0, 'rejected': []}
+
+        with open(self.path, 'rb') as f:
+            header_line = f.readline()
+            if not header_line.endswith(b'\n'):
+                return {'accepted': 0, 'rejected': []}
+            self.header = next(csv.reader([header_line.decode('utf-8')]))
+            if self.offset is None or size < self.offset:
+                # First poll from the start, or the file was truncated
+                self.offset = f.tell()
+
+            f.seek(self.offset)
+            data = f.read()
+
+        # Only consume complete lines; a partial last line waits for the next poll
+        complete = data[:data.rfind(b'\n') + 1]
+        readings = [
+            {key: value for key, value in zip(self.header, values)}
+            for values in csv.reader(complete.decode('utf-8').splitlines()) if values
+        ]
+        result = self.ingestor.submit(readings) if readings else {'accepted': 0, 'rejected': []}
+        # Advance only once submitted, so lines refused here are read again
+        self.offset += len(complete)
+        return result
+
+    def start(self):
+        """
+        Start polling the file in a background thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                result = self.poll()
+                if result['rejected']:
+                    print(f"Rejected {len(result['rejected'])} lines from {self.path}: {result['rejected'][:3]}")
+            except Exception as e:
+                print(f"Error tailing {self.path}: {e}")
+            time.sleep(self.poll_interval)
+
+# Global ingestor instance
+ingestor = Ingestor()
+
+def get_ingestor():
+    """
+    Get the global ingestor instance
+    """
+    return ingestor
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fold the AQI ingestion log into the dataset CSV')
+    parser.add_argument('command', choices=['compact'])
+    args = parser.parse_args()
+
+    print(f"Compacted {get_data_store().compact()} ingested rows")
@@ -0,0 +1,695 @@
+import argparse
+import base64
+import heapq
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from email.message import EmailMessage
+from urllib.parse import quote, urlencode, urlsplit
+
+# Notifications waiting for a worker; when full, a blocking submit() waits
+# up to ENQUEUE_TIMEOUT seconds and then drops the notification
+DELIVERY_QUEUE_SIZE = int(os.environ.get('AQI_DELIVERY_QUEUE_SIZE', '10000'))
+DELIVERY_WORKERS = int(os.environ.get('AQI_DELIVERY_WORKERS', '4'))
+ENQUEUE_TIMEOUT = 1.0
+
+# Transient failures are retried with exponential backoff and jitter
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 300.0
+
+# Delivery throughput is reported over this many trailing seconds
+THROUGHPUT_WINDOW = 60
+
+# Push services that Web Push endpoints may point at; "*." matches subdomains.
+# Anything else is refused, so subscribers cannot make the server request
+# arbitrary URLs.
+WEBPUSH_ALLOWED_HOSTS = tuple(filter(None, os.environ.get(
+    'AQI_WEBPUSH_HOSTS',
+    'fcm.googleapis.com,updates.push.services.mozilla.com,*.push.apple.com,*.notify.windows.com'
+).split(',')))
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+# Redirects are returned as statuses rather than followed, so a request
+# never ends up at a host that was not checked
+_opener = urllib.request.build_opener(_NoRedirect)
+
+def _post_json(url, payload, headers=None, timeout=10):
+    """
+    POST a JSON payload. Returns (status, decoded JSON body or None); HTTP
+    error statuses are returned, connection errors are raised.
+    """
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    return _post(url, body, 'application/json', headers, timeout)
+
+def _post_form(url, fields, timeout=10):
+    """
+    POST form fields, returning like _post_json
+    """
+    return _post(url, urlencode(fields).encode('ascii'), 'application/x-www-form-urlencoded', None, timeout)
+
+def _post(url, body, content_type, headers, timeout):
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': content_type, **(headers or {})})
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    try:
+        return status, json.loads(raw) if raw else None
+    except ValueError:
+        return status, None
+
+def _is_retryable(status):
+    return status == 429 or status >= 500
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _require_address(address, what):
+    if not isinstance(address, str) or not address.strip():
+        raise ValueError(f"address must be {what}")
+
+def _title(notification):
+    return f"{notification['level']}: air quality in {notification['location']}"
+
+class LogTransport:
+    """
+    Prints notifications, for development without a push service
+    """
+    name = 'log'
+    batch_size = 100
+
+    def send_batch(self, notifications):
+        for notification in notifications:
+            print(f"🚨 PUSH NOTIFICATION: {notification}")
+        return []
+
+class LoopbackTransport:
+    """
+    Accepts every batch without leaving the process, optionally after a
+    simulated round trip and with random transient failures, to benchmark
+    the pipeline itself
+    """
+    name = 'loopback'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, batch_size=500):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.batch_size = batch_size
+        self.delivered = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, notifications):
+        if self.latency:
+            time.sleep(self.latency)
+        failures = []
+        if self.failure_rate:
+            failures = [(i, True, 'simulated failure') for i in range(len(notifications))
+                        if random.random() < self.failure_rate]
+        with self._lock:
+            self.delivered += len(notifications) - len(failures)
+        return failures
+
+class FcmTransport:
+    """
+    Firebase Cloud Messaging through the HTTP v1 API, one request per device
+    token (the subscription `address`). Requests are authorized with
+    short-lived OAuth2 access tokens obtained by signing a JWT with the
+    service account's key.
+
+    Needs the `cryptography` package to sign the token requests.
+    """
+    name = 'fcm'
+    url = 'https://fcm.googleapis.com/v1/projects/{project}/messages:send'
+    scope = 'https://www.googleapis.com/auth/firebase.messaging'
+
+    # Error statuses of a single message worth retrying; the rest mean the
+    # token or message is invalid
+    RETRYABLE_ERRORS = ('UNAVAILABLE', 'INTERNAL', 'QUOTA_EXCEEDED')
+
+    # Access tokens are requested for an hour and renewed five minutes early
+    TOKEN_LIFETIME = 3600
+
+    def __init__(self, service_account, batch_size=500, timeout=10):
+        # Imported here: only deployments using FCM need it
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+        try:
+            self.project = service_account['project_id']
+            self.client_email = service_account['client_email']
+            key = serialization.load_pem_private_key(service_account['private_key'].encode('ascii'), password=None)
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError('FCM service account needs project_id, client_email and private_key')
+        if not isinstance(key, rsa.RSAPrivateKey):
+            raise ValueError('FCM service account key must be an RSA private key')
+
+        self._key = key
+        self._padding = padding.PKCS1v15()
+        self._hash = hashes.SHA256()
+        self.token_uri = service_account.get('token_uri') or 'https://oauth2.googleapis.com/token'
+        self.endpoint = self.url.format(project=quote(self.project, safe=''))
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._token = (None, 0)  # (access token, expiry)
+        self._token_lock = threading.Lock()
+
+    def validate_address(self, address):
+        _require_address(address, 'a device token')
+
+    def _access_token(self):
+        with self._token_lock:
+            token, expires = self._token
+            if time.time() < expires - 300:
+                return token
+
+            now = int(time.time())
+            header = _b64url(json.dumps({'typ': 'JWT', 'alg': 'RS256'}).encode())
+            claims = _b64url(json.dumps({'iss': self.client_email, 'scope': self.scope, 'aud': self.token_uri,
+                                         'iat': now, 'exp': now + self.TOKEN_LIFETIME}).encode())
+            signing_input = f"{header}.{claims}".encode('ascii')
+            assertion = f"{header}.{claims}.{_b64url(self._key.sign(signing_input, self._padding, self._hash))}"
+
+            status, body = _post_form(self.token_uri, {
+                'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+                'assertion': assertion
+            }, timeout=self.timeout)
+            if status != 200 or not (body or {}).get('access_token'):
+                raise OSError(f"FCM token request failed: HTTP {status}")
+
+            token = body['access_token']
+            self._token = (token, now + int(body.get('expires_in', self.TOKEN_LIFETIME)))
+            return token
+
+    def _expire_token(self, token):
+        with self._token_lock:
+            if self._token[0] == token:
+                self._token = (None, 0)
+
+    def send_batch(self, notifications):
+        failures = []
+        for i, notification in enumerate(notifications):
+            if not notification.get('address'):
+                failures.append((i, False, 'no device token'))
+                continue
+            try:
+                token = self._access_token()
+                status, body = _post_json(self.endpoint, {'message': {
+                    'token': notification['address'],
+                    'notification': {'title': _title(notification), 'body': notification['message']},
+                    'android': {'priority': 'high'}
+                }}, headers={'Authorization': f"Bearer {token}"}, timeout=self.timeout)
+            except OSError as e:
+                failures.append((i, True, str(e)))
+                continue
+
+            if status == 401:
+                # Revoked or expired early; the retry fetches a new one
+                self._expire_token(token)
+                failures.append((i, True, 'access token rejected'))
+            elif status >= 300:
+                error = ((body or {}).get('error') or {}).get('status') or f"HTTP {status}"
+                failures.append((i, error in self.RETRYABLE_ERRORS or _is_retryable(status), error))
+        return failures
+
+def validate_push_endpoint(endpoint, allowed_hosts=WEBPUSH_ALLOWED_HOSTS):
+    """
+    Check that a Web Push endpoint is an https URL on a known push service
+    """
+    _require_address(endpoint, 'a push service endpoint URL')
+    try:
+        parts = urlsplit(endpoint)
+        port = parts.port
+    except ValueError:
+        raise ValueError('push endpoint is not a valid URL')
+    host = (parts.hostname or '').lower()
+    if parts.scheme != 'https' or parts.username or parts.password or port not in (None, 443):
+        raise ValueError('push endpoint must be an https URL')
+    for allowed in allowed_hosts:
+        allowed = allowed.strip().lower()
+        if host == allowed or (allowed.startswith('*.') and host.endswith(allowed[1:])):
+            return endpoint
+    raise ValueError(f"push endpoint host {host} is not an allowed push service")
+
+class WebPushTransport:
+    """
+    Web Push to the browser push service endpoint stored as the subscription
+    `address`, authenticated with VAPID (RFC 8292). Only https endpoints on
+    `allowed_hosts` are contacted. Pushes carry no payload (which would need
+    per-subscription encryption keys); the service worker fetches the alert
+    when woken.
+
+    Needs the `cryptography` package to sign the VAPID tokens.
+    """
+    name = 'webpush'
+
+    # VAPID tokens are valid for at most 24 hours; renewed well before
+    TOKEN_LIFETIME = 12 * 3600
+
+    def __init__(self, private_key_pem, subject, allowed_hosts=WEBPUSH_ALLOWED_HOSTS,
+                 ttl=3600, batch_size=100, timeout=10):
+        # Imported here: only deployments using Web Push need it
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+        key = serialization.load_pem_private_key(private_key_pem, password=None)
+        if not isinstance(key, ec.EllipticCurvePrivateKey) or key.curve.name != 'secp256r1':
+            raise ValueError('VAPID key must be a P-256 EC private key')
+
+        self._key = key
+        self._sign_algorithm = ec.ECDSA(hashes.SHA256())
+        self._decode_signature = decode_dss_signature
+        self._public_key = _b64url(key.public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint))
+        self.subject = subject
+        self.allowed_hosts = allowed_hosts
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._tokens = {}  # audience -> (token, expiry)
+        self._tokens_lock = threading.Lock()
+
+    def validate_address(self, address):
+        validate_push_endpoint(address, self.allowed_hosts)
+
+    def _authorization(self, endpoint):
+        parts = urlsplit(endpoint)
+        audience = f"{parts.scheme}://{parts.netloc}"
+        # Delivery workers share the cache
+        with self._tokens_lock:
+            token, expires = self._tokens.get(audience, (None, 0))
+            if time.time() > expires - 3600:
+                expires = int(time.time()) + self.TOKEN_LIFETIME
+                header = _b64url(json.dumps({'typ': 'JWT', 'alg': 'ES256'}).encode())
+                claims = _b64url(json.dumps({'aud': audience, 'exp': expires, 'sub': self.subject}).encode())
+                signing_input = f"{header}.{claims}".encode('ascii')
+                r, s = self._decode_signature(self._key.sign(signing_input, self._sign_algorithm))
+                token = f"{header}.{claims}.{_b64url(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}"
+                self._tokens[audience] = (token, expires)
+        return f"vapid t={token}, k={self._public_key}"
+
+    def send_batch(self, notifications):
+        failures = []
+        for i, notification in enumerate(notifications):
+            endpoint = notification.get('address')
+            try:
+                self.validate_address(endpoint)
+            except ValueError as e:
+                failures.append((i, False, str(e)))
+                continue
+            try:
+                status, _ = _post_json(endpoint, None, headers={
+                    'TTL': str(self.ttl), 'Urgency': 'high',
+                    'Authorization': self._authorization(endpoint)}, timeout=self.timeout)
+            except OSError as e:
+                failures.append((i, True, str(e)))
+                continue
+            if status in (404, 410):
+                failures.append((i, False, 'push subscription expired'))
+            elif status >= 300:
+                failures.append((i, _is_retryable(status), f"HTTP {status}"))
+        return failures
+
+class SmsTransport:
+    """
+    SMS through an HTTP gateway that accepts a batch of messages per request
+    """
+    name = 'sms'
+
+    # Longer texts are split into several billed messages
+    MAX_LENGTH = 160
+
+    def __init__(self, gateway_url, api_key=None, batch_size=100, timeout=10):
+        self.gateway_url = gateway_url
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def validate_address(self, address):
+        _require_address(address, 'a phone number')
+
+    def send_batch(self, notifications):
+        failures = []
+        messages = []
+        indices = []
+        for i, notification in enumerate(notifications):
+            if not notification.get('address'):
+                failures.append((i, False, 'no phone number'))
+                continue
+            messages.append({'to': notification['address'], 'body': notification['message'][:self.MAX_LENGTH]})
+            indices.append(i)
+
+        if messages:
+            headers = {'Authorization': f"Bearer {self.api_key}"} if self.api_key else None
+            status, _ = _post_json(self.gateway_url, {'messages': messages}, headers=headers, timeout=self.timeout)
+            if status >= 300:
+                failures.extend((i, _is_retryable(status), f"HTTP {status}") for i in indices)
+        return failures
+
+class EmailTransport:
+    """
+    Email over SMTP, sending a whole batch through one connection
+    """
+    name = 'email'
+
+    def __init__(self, host, port=587, username=None, password=None, sender=None,
+                 use_tls=True, batch_size=50, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.use_tls = use_tls
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def validate_address(self, address):
+        _require_address(address, 'an email address')
+        if '@' not in address or any(c in address for c in '\r\n'):
+            raise ValueError('address must be an email address')
+
+    def send_batch(self, notifications):
+        failures = []
+        # Connection errors fail the whole batch, which is then retried
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+
+            for i, notification in enumerate(notifications):
+                if not notification.get('address'):
+                    failures.append((i, False, 'no email address'))
+                    continue
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = notification['address']
+                message['Subject'] = _title(notification)
+                message.set_content(notification['message'])
+                try:
+                    smtp.send_message(message)
+                except smtplib.SMTPRecipientsRefused as e:
+                    failures.append((i, False, str(e)))
+                except smtplib.SMTPResponseException as e:
+                    failures.append((i, e.smtp_code < 500, str(e)))
+        return failures
+
+def build_transports():
+    """
+    Transports subscribers can choose in this process: log always, the
+    others when their credentials are configured. The loopback transport is
+    only used by benchmarks.
+    """
+    transports = [LogTransport()]
+    if os.environ.get('AQI_VAPID_PRIVATE_KEY'):
+        try:
+            with open(os.environ['AQI_VAPID_PRIVATE_KEY'], 'rb') as f:
+                transports.append(WebPushTransport(f.read(), os.environ.get('AQI_VAPID_SUBJECT', 'mailto:admin@localhost')))
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Error enabling Web Push: {e}")
+    if os.environ.get('AQI_FCM_SERVICE_ACCOUNT'):
+        try:
+            with open(os.environ['AQI_FCM_SERVICE_ACCOUNT']) as f:
+                transports.append(FcmTransport(json.load(f)))
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Error enabling FCM: {e}")
+    if os.environ.get('AQI_SMS_GATEWAY_URL'):
+        transports.append(SmsTransport(os.environ['AQI_SMS_GATEWAY_URL'], os.environ.get('AQI_SMS_API_KEY')))
+    if os.environ.get('AQI_SMTP_HOST'):
+        transports.append(EmailTransport(
+            os.environ['AQI_SMTP_HOST'],
+            port=int(os.environ.get('AQI_SMTP_PORT', '587')),
+            username=os.environ.get('AQI_SMTP_USER'),
+            password=os.environ.get('AQI_SMTP_PASSWORD'),
+            sender=os.environ.get('AQI_SMTP_SENDER')))
+    return {transport.name: transport for transport in transports}
+
+class DeliveryPipeline:
+    """
+    Delivers notifications off the monitoring thread. Notifications go into
+    a bounded queue drained by a pool of workers; each worker takes up to
+    `batch_size` queued notifications (waiting at most `linger` seconds for
+    more), groups them by transport and sends each group in the transport's
+    batch size. Transient failures are retried with exponential backoff by
+    a separate thread, up to `max_attempts` attempts.
+    """
+    def __init__(self, transports=None, queue_size=DELIVERY_QUEUE_SIZE, workers=DELIVERY_WORKERS,
+                 batch_size=500, linger=0.05, max_attempts=MAX_ATTEMPTS,
+                 enqueue_timeout=ENQUEUE_TIMEOUT):
+        self.transports = transports if transports is not None else build_transports()
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._retries = []
+        self._retry_ready = threading.Condition()
+        self._retry_sequence = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started_at = None
+        self.submitted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.last_error = None
+        self._transport_stats = {name: {'delivered': 0, 'failed': 0, 'batches': 0, 'send_ms': 0.0}
+                                 for name in self.transports}
+        self._recent = deque()  # (monotonic time, notifications delivered)
+        self.latencies = deque(maxlen=1000)  # Seconds from submit to delivery
+
+    def validate_address(self, transport, address):
+        """
+        Check that `transport` is available here and `address` is usable
+        with it; raises ValueError otherwise
+        """
+        if transport not in self.transports:
+            raise ValueError(f'Unknown transport "{transport}"')
+        validate = getattr(self.transports[transport], 'validate_address', None)
+        if validate is not None:
+            validate(address)
+
+    def submit(self, notification, block=True):
+        """
+        Queue a notification for delivery. With `block`, waits while the
+        queue is full for at most `enqueue_timeout` seconds; without it,
+        gives up at once. Returns False if the notification was dropped.
+        """
+        self.start()
+        item = {'notification': notification, 'attempts': 0, 'submitted_at': time.monotonic()}
+        try:
+            if block:
+                self._queue.put(item, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def start(self):
+        """
+        Start the worker pool and the retry thread
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._started_at = time.monotonic()
+            self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+            self._threads.append(threading.Thread(target=self._run_retries, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item['notification'].get('transport') or 'log', []).append(item)
+
+            for name, items in groups.items():
+                transport = self.transports.get(name)
+                if transport is None:
+                    self._record(name, [], [(item, False, f"unknown transport: {name}") for item in items], 0.0)
+                    continue
+                size = transport.batch_size
+                for start in range(0, len(items), size):
+                    self._send(transport, items[start:start + size])
+
+    def _send(self, transport, items):
+        started = time.perf_counter()
+        try:
+            failures = transport.send_batch([item['notification'] for item in items]) or []
+            failures = [(items[i], retryable, error) for i, retryable, error in failures]
+        except Exception as e:
+            failures = [(item, True, str(e)) for item in items]
+        self._record(transport.name, items, failures, (time.perf_counter() - started) * 1000)
+
+    def _record(self, name, items, failures, send_ms):
+        """
+        Count a sent batch and schedule retries of its transient failures
+        """
+        now = time.monotonic()
+        failed_items = {id(item) for item, _, _ in failures}
+        delivered_items = [item for item in items if id(item) not in failed_items]
+        retry = []
+        failed = 0
+        with self._lock:
+            for item, retryable, error in failures:
+                item['attempts'] += 1
+                self.last_error = f"{name}: {error}"
+                if retryable and item['attempts'] < self.max_attempts:
+                    retry.append(item)
+                else:
+                    failed += 1
+
+            delivered = len(delivered_items)
+            self.delivered += delivered
+            self.failed += failed
+            self.retried += len(retry)
+            stats = self._transport_stats.setdefault(name, {'delivered': 0, 'failed': 0, 'batches': 0, 'send_ms': 0.0})
+            stats['delivered'] += delivered
+            stats['failed'] += failed
+            stats['batches'] += 1 if items else 0
+            stats['send_ms'] += send_ms
+
+            self._recent.append((now, delivered))
+            while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+
+            self.latencies.extend(now - item['submitted_at'] for item in delivered_items)
+
+        for item in retry:
+            self._schedule_retry(item)
+
+    def _schedule_retry(self, item):
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (item['attempts'] - 1))
+        # Jitter spreads out retries of notifications that failed together
+        delay *= random.uniform(0.5, 1.0)
+        with self._retry_ready:
+            self._retry_sequence += 1
+            heapq.heappush(self._retries, (time.monotonic() + delay, self._retry_sequence, item))
+            self._retry_ready.notify()
+
+    def _run_retries(self):
+        while True:
+            with self._retry_ready:
+                while not self._retries or self._retries[0][0] > time.monotonic():
+                    self._retry_ready.wait(self._retries[0][0] - time.monotonic() if self._retries else None)
+                due = []
+                while self._retries and self._retries[0][0] <= time.monotonic():
+                    due.append(heapq.heappop(self._retries)[2])
+            # Retries wait for room in the queue rather than being dropped
+            for item in due:
+                self._queue.put(item)
+
+    def pending(self):
+        """
+        Notifications queued or waiting for a retry
+        """
+        with self._retry_ready:
+            waiting = len(self._retries)
+        return self._queue.qsize() + waiting
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            window = min(THROUGHPUT_WINDOW, now - self._started_at) if self._started_at else 0
+            recent = sum(count for at, count in self._recent if at >= now - THROUGHPUT_WINDOW)
+            transports = {}
+            for name, stats in self._transport_stats.items():
+                transports[name] = {
+                    'delivered': stats['delivered'],
+                    'failed': stats['failed'],
+                    'batches': stats['batches'],
+                    'avg_send_ms': round(stats['send_ms'] / stats['batches'], 3) if stats['batches'] else None
+                }
+            result = {
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self.queue_size,
+                'workers': self.workers,
+                'submitted': self.submitted,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'throughput_per_sec': round(recent / window, 1) if window > 0 else 0.0,
+                'last_error': self.last_error,
+                'transports': transports
+            }
+            latencies = sorted(self.latencies)
+        with self._retry_ready:
+            result['awaiting_retry'] = len(self._retries)
+        result['delivery_latency_ms'] = {
+            'avg': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p95': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 3)
+        } if latencies else None
+        return result
+
+# Global delivery pipeline instance
+delivery_pipeline = DeliveryPipeline()
+
+def get_delivery_pipeline():
+    """
+    Get the global delivery pipeline instance
+    """
+    return delivery_pipeline
+
+def benchmark(count, workers, latency, failure_rate, batch_size):
+    """
+    Push `count` notifications through a pipeline with a loopback transport
+    and report the delivery rate
+    """
+    transport = LoopbackTransport(latency=latency, failure_rate=failure_rate, batch_size=batch_size)
+    pipeline = DeliveryPipeline(transports={transport.name: transport}, workers=workers)
+    notification = {'user_id': 'benchmark', 'location': 'Delhi', 'aqi': 250.0, 'threshold': 100,
+                    'message': 'Benchmark alert', 'level': 'UNHEALTHY', 'transport': transport.name}
+
+    started = time.perf_counter()
+    for i in range(count):
+        pipeline.submit({**notification, 'user_id': f"benchmark-{i}"})
+    while pipeline.delivered + pipeline.failed + pipeline.dropped < count:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    return pipeline.stats(), elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark notification delivery against the loopback transport')
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=DELIVERY_WORKERS)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per batch')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of notifications failing transiently')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    stats, elapsed = benchmark(args.count, args.workers, args.latency, args.failure_rate, args.batch_size)
+    print(f"Delivered {stats['delivered']} of {args.count} notifications in {elapsed:.2f}s "
+          f"({stats['delivered'] / elapsed:.0f}/s), {stats['retried']} retries, {stats['failed']} failed, "
+          f"{stats['dropped']} dropped, {stats['transports']['loopback']['batches']} batches")
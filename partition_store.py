@@ -0,0 +1,343 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from dataset_cache import POLLUTANT_COLUMNS
+from data_cleaning import FLAG_DUPLICATE, FLAG_INTERPOLATED, FILL_GAP_DAYS, clean_frame
+from pollutants import AQI_BUCKETS
+
+PARTITION_FORMAT_VERSION = 2
+
+# One record per reading; codes index AQI_BUCKETS and POLLUTANT_COLUMNS (-1 when missing)
+RECORD_DTYPE = np.dtype(
+    [('date', '<i8'), ('aqi', '<f8'), ('aqi_bucket', 'i1'), ('main_pollutant', 'i1')]
+    + [(column, '<f4') for column in POLLUTANT_COLUMNS]
+    + [('quality_flags', 'u1')]
+)
+
+def _month(value):
+    return str(np.datetime64(value, 'M'))
+
+def _codes(values, categories):
+    # Remap the column's own category codes through a small lookup; the
+    # trailing -1 is what code -1 (missing) picks up
+    values = pd.Categorical(values)
+    lookup = np.array([categories.index(name) if name in categories else -1 for name in values.categories] + [-1],
+                      dtype=np.int8)
+    return lookup[values.codes]
+
+def frame_to_records_array(frame):
+    """
+    Pack normalized rows into the fixed-width records stored in partitions
+    """
+    records = np.empty(len(frame), dtype=RECORD_DTYPE)
+    records['date'] = frame['date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    records['aqi'] = frame['aqi'].to_numpy(dtype=np.float64)
+    records['aqi_bucket'] = _codes(frame['aqi_bucket'], AQI_BUCKETS)
+    records['main_pollutant'] = _codes(frame['main_pollutant'], POLLUTANT_COLUMNS)
+    for column in POLLUTANT_COLUMNS:
+        records[column] = frame[column].to_numpy(dtype=np.float32)
+    records['quality_flags'] = frame['quality_flags'].to_numpy() if 'quality_flags' in frame.columns else 0
+    return records
+
+def records_to_frame(name, records):
+    """
+    Unpack partition records into rows shaped like the normalized dataset
+    """
+    n = len(records)
+    dates = pd.to_datetime(np.asarray(records['date']), unit='ns')
+    return pd.DataFrame({
+        'city': pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [name]),
+        'date': dates,
+        'aqi': np.asarray(records['aqi']),
+        'aqi_bucket': pd.Categorical.from_codes(np.asarray(records['aqi_bucket']), AQI_BUCKETS),
+        **{column: np.asarray(records[column]) for column in POLLUTANT_COLUMNS},
+        'quality_flags': np.asarray(records['quality_flags']),
+        'main_pollutant': pd.Categorical.from_codes(np.asarray(records['main_pollutant']), POLLUTANT_COLUMNS),
+        'timestamp': dates
+    })
+
+class PartitionStore:
+    """
+    Dataset stored as one binary file per (city, month) under `root`.
+
+    A manifest records the row count and min/max date of every partition,
+    so a range query only opens the partitions overlapping the range, and
+    those are memory-mapped rather than read whole.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self._manifest = None
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def manifest(self):
+        """
+        Get the manifest, rereading it when another process rewrote it
+        """
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            return {'format': PARTITION_FORMAT_VERSION, 'cities': {}}
+
+        if mtime != self._manifest_mtime:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('format') != PARTITION_FORMAT_VERSION:
+                raise ValueError(f"Unsupported partition format in {self.root}")
+            self._manifest, self._manifest_mtime = manifest, mtime
+        return self._manifest
+
+    def has_city(self, location):
+        return str(location).strip().lower() in self.manifest()['cities']
+
+    def cities(self):
+        return sorted(entry['name'] for entry in self.manifest()['cities'].values())
+
+    def partitions_for(self, location, start=None, end=None):
+        """
+        Manifest entries of a city's partitions that overlap [start, end], in date order
+        """
+        entry = self.manifest()['cities'].get(str(location).strip().lower())
+        if entry is None:
+            return []
+
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        selected = []
+        for month in sorted(entry['partitions']):
+            partition = entry['partitions'][month]
+            if start is not None and pd.Timestamp(partition['max_date']) < start:
+                continue
+            if end is not None and pd.Timestamp(partition['min_date']) > end:
+                break
+            selected.append(partition)
+        return selected
+
+    def read_range(self, location, start=None, end=None, limit=None):
+        """
+        Get a city's rows between `start` and `end` (inclusive), reading
+        partitions in date order and stopping once `limit` rows are found
+        """
+        entry = self.manifest()['cities'].get(str(location).strip().lower())
+        if entry is None:
+            return pd.DataFrame()
+
+        lo = None if start is None else pd.Timestamp(start).value
+        hi = None if end is None else pd.Timestamp(end).value
+
+        chunks = []
+        found = 0
+        for partition in self.partitions_for(location, start, end):
+            records = np.load(os.path.join(self.root, partition['file']), mmap_mode='r')
+            dates = records['date']
+            first = 0 if lo is None else int(np.searchsorted(dates, lo, side='left'))
+            last = len(records) if hi is None else int(np.searchsorted(dates, hi, side='right'))
+            if limit is not None:
+                last = min(last, first + limit - found)
+            if last > first:
+                chunks.append(np.array(records[first:last]))
+                found += last - first
+            if limit is not None and found >= limit:
+                break
+
+        records = np.concatenate(chunks) if chunks else np.empty(0, dtype=RECORD_DTYPE)
+        return records_to_frame(entry['name'], records)
+
+    def append(self, frame):
+        """
+        Add normalized rows, rewriting only the partitions they fall into
+        """
+        if frame.empty:
+            return 0
+
+        with self._lock:
+            manifest = json.loads(json.dumps(self.manifest()))
+            keys = frame['city'].astype(str).str.strip().str.lower().to_numpy()
+            months = frame['date'].to_numpy().astype('datetime64[M]')
+
+            order = np.lexsort((frame['date'].to_numpy(), months, keys))
+            keys, months = keys[order], months[order]
+            records = frame_to_records_array(frame.iloc[order])
+            names = frame['city'].astype(str).to_numpy()[order]
+
+            # Runs of rows with the same city and month
+            boundaries = np.flatnonzero((keys[1:] != keys[:-1]) | (months[1:] != months[:-1])) + 1
+            starts = np.r_[0, boundaries]
+            stops = np.r_[boundaries, len(keys)]
+
+            for start, stop in zip(starts, stops):
+                key, month = keys[start], _month(months[start])
+                entry = manifest['cities'].setdefault(key, {'name': names[start], 'partitions': {}})
+                self._write_partition(entry, key, month, records[start:stop])
+
+            self._save_manifest(manifest)
+            return len(frame)
+
+    def ingest(self, frame, fill_gap_days=FILL_GAP_DAYS):
+        """
+        Add freshly ingested rows, filling the gaps they open or close
+        against the stored rows around them, as the in-memory dataset does
+        when it re-cleans after an append
+        """
+        if frame.empty or fill_gap_days <= 0:
+            return self.append(frame)
+        # Imported here: the data store is only needed for merging
+        from data_store import merge_frames
+
+        # Only stored rows this close to the new ones can border a fillable gap
+        margin = pd.Timedelta(days=fill_gap_days + 1)
+        keys = frame['city'].astype(str).str.strip().str.lower().to_numpy()
+        filled = []
+        for _, rows in frame.groupby(keys, sort=False, observed=True):
+            rows = rows.sort_values('date', kind='stable')
+            start = rows['date'].iat[0].normalize() - margin
+            end = rows['date'].iat[-1].normalize() + margin + pd.Timedelta(days=1)
+            stored = self.read_range(rows['city'].iat[0], start, end)
+
+            merged = merge_frames(stored, rows).reset_index(drop=True)
+            cleaned = clean_frame(merged, np.zeros(len(merged), dtype=np.int64), fill_gap_days)
+            new = (cleaned['quality_flags'].to_numpy() & FLAG_INTERPOLATED) != 0
+            if not stored.empty:
+                new &= ~cleaned['date'].isin(stored['date']).to_numpy()
+            filled.append(cleaned[new])
+
+        return self.append(pd.concat([frame, *filled], ignore_index=True))
+
+    def _write_partition(self, entry, key, month, records):
+        partition = entry['partitions'].get(month)
+        filename = partition['file'] if partition else f"{quote(key, safe='')}/{month}.npy"
+        path = os.path.join(self.root, filename)
+
+        if partition is not None:
+            records = np.concatenate([np.load(path), records])
+        # Stable, so readings appended later for the same time sort last
+        records = records[np.argsort(records['date'], kind='stable')]
+
+        # Keep the last reading of every timestamp, flagged like the
+        # in-memory cleaning stage does
+        dates = records['date']
+        same = dates[1:] == dates[:-1]
+        if same.any():
+            records['quality_flags'][1:][same] |= FLAG_DUPLICATE
+            records = records[np.r_[~same, True]]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, 'wb') as f:
+            np.save(f, records)
+        # Readers that mapped the old file keep reading it until they close it
+        os.replace(tmp, path)
+
+        entry['partitions'][month] = {
+            'file': filename,
+            'rows': int(len(records)),
+            'min_date': str(np.datetime64(int(records['date'][0]), 'ns')),
+            'max_date': str(np.datetime64(int(records['date'][-1]), 'ns'))
+        }
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self.manifest_path}.tmp{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+def _build_into(csv_path, root, chunksize):
+    # Imported here: the data store is only needed for normalization
+    from data_store import normalize_raw_rows, read_log
+
+    store = PartitionStore(root)
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        store.append(normalize_raw_rows(chunk))
+
+    # Ingested rows not yet compacted into the CSV, as the dataset store replays them
+    logged = read_log(csv_path)
+    if not logged.empty:
+        store.append(normalize_raw_rows(logged))
+    return store
+
+def _fill_gaps(source, root, fill_gap_days):
+    """
+    Gap-fill every city of `source` into a new store at `root`; one city's
+    rows are in memory at a time
+    """
+    store = PartitionStore(root)
+    for name in source.cities():
+        rows = source.read_range(name)
+        store.append(clean_frame(rows, np.zeros(len(rows), dtype=np.int64), fill_gap_days))
+    return store
+
+def build_partitions(csv_path, root, chunksize=1000000, fill_gap_days=FILL_GAP_DAYS):
+    """
+    Partition a CSV in the dataset schema (plus its ingestion log), reading
+    it in chunks so memory stays bounded by the chunk size.
+
+    Rows get the same cleaning as the in-memory dataset: load stages on
+    every chunk, the last reading per timestamp kept when partitions are
+    merged, and gaps filled per city once everything is written. The store
+    is built in a fresh directory and swapped in, so rebuilding is
+    idempotent.
+    """
+    root = os.path.normpath(root)
+    building = f"{root}.building{os.getpid()}"
+    filling = f"{root}.filling{os.getpid()}"
+    for directory in (building, filling):
+        shutil.rmtree(directory, ignore_errors=True)
+
+    try:
+        store = _build_into(csv_path, building, chunksize)
+        if fill_gap_days > 0:
+            store = _fill_gaps(store, filling, fill_gap_days)
+        built = store.root
+
+        # Swap the new store in; readers holding old files keep them until closed
+        previous = f"{root}.previous{os.getpid()}"
+        if os.path.exists(root):
+            os.replace(root, previous)
+        os.replace(built, root)
+        shutil.rmtree(previous, ignore_errors=True)
+    finally:
+        for directory in (building, filling):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    store = PartitionStore(root)
+    total = sum(partition['rows'] for entry in store.manifest()['cities'].values()
+                for partition in entry['partitions'].values())
+    return store, total
+
+# Global partition store, used when AQI_PARTITION_DIR is set
+partition_store = PartitionStore(os.environ['AQI_PARTITION_DIR']) if os.environ.get('AQI_PARTITION_DIR') else None
+
+def get_partition_store():
+    """
+    Get the global partition store, or None when history is served from memory
+    """
+    if partition_store is None or not partition_store.exists():
+        return None
+    return partition_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partition the AQI dataset by city and month')
+    parser.add_argument('csv', nargs='?', default='data/aqi_data.csv')
+    parser.add_argument('--root', default='data/partitions')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='CSV rows read at a time')
+    parser.add_argument('--fill-gap-days', type=int, default=FILL_GAP_DAYS,
+                        help='Interpolate gaps of up to this many days (default: AQI_FILL_GAP_DAYS)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store, total = build_partitions(args.csv, args.root, args.chunksize, args.fill_gap_days)
+    partitions = sum(len(entry['partitions']) for entry in store.manifest()['cities'].values())
+    print(f"Wrote {total} rows into {partitions} partitions under {args.root} in {time.perf_counter() - started:.2f}s")
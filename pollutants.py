@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# CPCB National AQI breakpoints: concentration edges of the Good, Satisfactory,
+# Moderate, Poor, Very Poor and Severe bands (mg/m3 for CO, ug/m3 otherwise).
+# The last edge closes the Severe band so it can be interpolated up to 500.
+CPCB_BREAKPOINTS = {
+    'PM10': [0, 50, 100, 250, 350, 430, 510],
+    'PM2.5': [0, 30, 60, 90, 120, 250, 380],
+    'NO2': [0, 40, 80, 180, 280, 400, 520],
+    'O3': [0, 50, 100, 168, 208, 748, 1000],
+    'CO': [0, 1, 2, 10, 17, 34, 50],
+    'SO2': [0, 40, 80, 380, 800, 1600, 2100],
+    'NH3': [0, 200, 400, 800, 1200, 1800, 2400]
+}
+INDEX_BREAKPOINTS = np.array([0, 50, 100, 200, 300, 400, 500], dtype=np.float64)
+
+AQI_BUCKETS = ['Good', 'Satisfactory', 'Moderate', 'Poor', 'Very Poor', 'Severe']
+
+# CPCB only reports an AQI when at least this many sub-indices are available,
+# one of which must be a particulate matter reading
+MIN_SUB_INDICES = 3
+PARTICULATES = ['PM2.5', 'PM10']
+
+def sub_index(concentration, breakpoints):
+    """
+    Vectorized CPCB sub-index of one pollutant. np.interp locates each
+    reading's band by binary search over the breakpoints and interpolates
+    linearly inside it; readings beyond the last band are capped at 500.
+    """
+    concentration = np.asarray(concentration, dtype=np.float64)
+    return np.interp(concentration, breakpoints, INDEX_BREAKPOINTS)
+
+def aqi_bucket(aqi):
+    """
+    CPCB category of each AQI value, as a categorical
+    """
+    aqi = np.asarray(aqi, dtype=np.float64)
+    codes = np.searchsorted(INDEX_BREAKPOINTS[1:-1], aqi, side='left').astype(np.int8)
+    codes[np.isnan(aqi)] = -1
+    return pd.Categorical.from_codes(codes, AQI_BUCKETS)
+
+def compute_aqi(readings):
+    """
+    Compute AQI, AQI bucket and dominant pollutant for every row.
+
+    AQI is the maximum sub-index and the dominant pollutant the one that
+    sets it; both are reported only where CPCB's minimum data rule holds.
+    """
+    names = [name for name in CPCB_BREAKPOINTS if name in readings]
+    rows = len(next(iter(readings.values()))) if readings else 0
+
+    # Fold one pollutant at a time into running row-wise reductions, so no
+    # (pollutants x rows) matrix is ever materialized. Sub-indices are never
+    # negative, so -1 marks a row with no reading yet
+    best = np.full(rows, -1.0)
+    dominant = np.full(rows, -1, dtype=np.int8)
+    measured = np.zeros(rows, dtype=np.int8)
+    particulate = np.zeros(rows, dtype=bool)
+    for i, name in enumerate(names):
+        index = sub_index(readings[name], CPCB_BREAKPOINTS[name])
+        present = ~np.isnan(index)
+        measured += present
+        if name in PARTICULATES:
+            particulate |= present
+        # NaN compares False, so a missing reading never takes over a row
+        np.putmask(dominant, index > best, i)
+        np.fmax(best, index, out=best)
+
+    valid = (measured >= MIN_SUB_INDICES) & particulate
+    dominant[~valid] = -1
+    aqi = np.where(valid, np.round(best), np.nan)
+
+    return aqi, aqi_bucket(aqi), pd.Categorical.from_codes(dominant, names)
+
+def derive_missing_aqi(df):
+    """
+    Load pipeline stage: fill AQI and AQI bucket where the source left them
+    blank, and set the dominant pollutant of every row
+    """
+    readings = {name: df[name].to_numpy() for name in CPCB_BREAKPOINTS if name in df.columns}
+    aqi, _, dominant = compute_aqi(readings)
+
+    source_aqi = df['aqi'].to_numpy(dtype=np.float64)
+    filled_aqi = np.where(np.isnan(source_aqi), aqi, source_aqi)
+
+    source_bucket = df['aqi_bucket'].astype(pd.CategoricalDtype(AQI_BUCKETS))
+    derived_bucket = aqi_bucket(filled_aqi)
+    filled_bucket = source_bucket.where(source_bucket.notna(), pd.Series(derived_bucket, index=df.index))
+
+    return df.assign(aqi=filled_aqi, aqi_bucket=filled_bucket, main_pollutant=dominant)
@@ -1,9 +1,64 @@
 import json
+import math
+import queue
 import threading
 import time
+from collections import deque
 from datetime import datetime, timedelta
+from city_index import get_city_index
+from data_store import get_data_store
 from utils import get_latest_aqi_by_location
 from health_recommendations import get_alert_threshold_message
+from subscription_index import SubscriptionIndex, CooldownScheduler
+from notification_delivery import get_delivery_pipeline
+
+# Alerts are driven by dataset changes; the full sweep only catches
+# anything an event missed
+SAFETY_SWEEP_INTERVAL = 6 * 3600
+
+# Minimum time between two alerts to the same subscriber, unless the
+# subscription sets its own
+DEFAULT_COOLDOWN_MINUTES = 120
+
+# How often the monitor checks the dataset file for changes made outside
+# this process (appends through the ingestor are signalled immediately)
+DATA_WATCH_INTERVAL = 5
+
+# Subscription fields holding delivery credentials (device tokens, push
+# endpoints, phone numbers, email addresses), never listed back
+PRIVATE_FIELDS = ('address',)
+
+def parse_alert_threshold(value):
+    """
+    Validate a subscription's AQI threshold, returning it as a float
+    """
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('threshold must be a number')
+    if not math.isfinite(threshold) or threshold < 0:
+        raise ValueError('threshold must be a non-negative number')
+    return threshold
+
+def parse_cooldown_minutes(value):
+    """
+    Validate a subscription's cooldown in minutes; None means the default
+    """
+    if value is None:
+        return DEFAULT_COOLDOWN_MINUTES
+    if isinstance(value, bool):
+        raise ValueError('cooldown_minutes must be a number')
+    try:
+        cooldown = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('cooldown_minutes must be a number')
+    if not math.isfinite(cooldown) or cooldown < 0:
+        raise ValueError('cooldown_minutes must be a non-negative number')
+    return cooldown
+
+def _cooldown_of(subscription):
+    cooldown = subscription.get('cooldown_minutes')
+    return DEFAULT_COOLDOWN_MINUTES if cooldown is None else cooldown
 
 class NotificationManager:
     def __init__(self):
@@ -11,22 +66,57 @@ class NotificationManager:
         self.alert_history = {}  # Track recent alerts to avoid spam
         self.monitoring_active = False
         self.monitoring_thread = None
+        self.last_sweep = None
+        self.threshold_index = SubscriptionIndex()  # Subscriptions per city sorted by threshold
+        self._index_lock = threading.Lock()
+        self._changes = queue.Queue()
+        self.cooldowns = CooldownScheduler()  # Subscriptions in cooldown, by end time
+        self._listening = False
+        self.events_processed = 0
+        self.alert_latencies = deque(maxlen=1000)  # Seconds from data change to alert
+        self._alerting = set()  # Subscriptions with an alert being queued, by id
+        self.alerts_dropped = 0
         
-    def subscribe_user(self, user_id, location, threshold=100, age_group=None, health_conditions=None):
+    def subscribe_user(self, user_id, location, threshold=100, age_group=None, health_conditions=None,
+                       cooldown_minutes=DEFAULT_COOLDOWN_MINUTES, transport='log', address=None):
         """
-        Subscribe a user to push notifications for a specific location and threshold
+        Subscribe a user to push notifications for a specific location and
+        threshold, delivered through `transport` to `address` (device token,
+        push endpoint, phone number or email address). Raises ValueError for
+        an invalid threshold, cooldown, transport or address, before
+        anything is stored.
         """
-        self.subscriptions[user_id] = {
+        threshold = parse_alert_threshold(threshold)
+        cooldown_minutes = parse_cooldown_minutes(cooldown_minutes)
+        get_delivery_pipeline().validate_address(transport, address)
+        
+        subscription = {
             'location': location,
             'threshold': threshold,
             'age_group': age_group,
             'health_conditions': health_conditions,
+            'cooldown_minutes': cooldown_minutes,
+            'transport': transport,
+            'address': address,
             'created_at': datetime.now(),
-            'last_alert': None
+            'last_alert': None,
+            'cooldown_until': None
         }
         
+        with self._index_lock:
+            previous = self.subscriptions.get(user_id)
+            if previous is not None and previous['cooldown_until'] is None:
+                self.threshold_index.remove(user_id, previous['location'], previous['threshold'])
+            self.subscriptions[user_id] = subscription
+            self.threshold_index.add(user_id, location, threshold)
+        
         if not self.monitoring_active:
             self.start_monitoring()
+        
+        # Alerts otherwise wait for the next data change or safety sweep
+        current_aqi = self._get_current_aqi(location)
+        if current_aqi is not None:
+            self._check_user_threshold(user_id, subscription, current_aqi, block=True)
             
         return True
     
@@ -34,16 +124,24 @@ class NotificationManager:
         """
         Unsubscribe a user from notifications
         """
-        if user_id in self.subscriptions:
-            del self.subscriptions[user_id]
+        with self._index_lock:
+            subscription = self.subscriptions.pop(user_id, None)
+            if subscription is None:
+                return False
+            # Subscriptions in cooldown are out of the index; their scheduled
+            # entry is skipped when it comes due
+            if subscription['cooldown_until'] is None:
+                self.threshold_index.remove(user_id, subscription['location'], subscription['threshold'])
             return True
-        return False
     
     def start_monitoring(self):
         """
         Start the background monitoring thread
         """
         if not self.monitoring_active:
+            if not self._listening:
+                get_data_store().add_listener(self._on_dataset_change)
+                self._listening = True
             self.monitoring_active = True
             self.monitoring_thread = threading.Thread(target=self._monitor_aqi_levels)
             self.monitoring_thread.daemon = True
@@ -59,57 +157,282 @@ class NotificationManager:
     
     def _monitor_aqi_levels(self):
         """
-        Background thread to monitor AQI levels and send alerts
+        Background thread to monitor AQI levels and send alerts.
+        
+        Cities are re-evaluated as soon as the dataset changes; a full sweep
+        runs at start and then every SAFETY_SWEEP_INTERVAL as a safety net.
         """
+        next_sweep = time.monotonic()
         while self.monitoring_active:
             try:
-                for user_id, subscription in self.subscriptions.items():
-                    self._check_user_threshold(user_id, subscription)
+                if time.monotonic() >= next_sweep:
+                    self.run_sweep()
+                    next_sweep = time.monotonic() + SAFETY_SWEEP_INTERVAL
+                
+                self.process_due_cooldowns()
+                
+                # Notices file reloads even when no request touches the data
+                get_data_store().snapshot()
+                
+                # Wake up for the next data change, file check or cooldown end
+                timeout = DATA_WATCH_INTERVAL
+                next_due = self.cooldowns.next_due()
+                if next_due is not None:
+                    timeout = max(0, min(timeout, next_due - time.monotonic()))
                 
-                # Check every 30 minutes
-                time.sleep(1800)
+                try:
+                    previous, snapshot, changed_at = self._changes.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                self._handle_change(previous, snapshot, changed_at)
                 
             except Exception as e:
                 print(f"Error in monitoring thread: {e}")
                 time.sleep(60)  # Wait 1 minute before retrying
     
-    def _check_user_threshold(self, user_id, subscription):
+    def _on_dataset_change(self, previous, snapshot):
+        """
+        Dataset listener: queue the change for the monitoring thread
+        """
+        self._changes.put((previous, snapshot, time.monotonic()))
+    
+    def _handle_change(self, previous, snapshot, changed_at):
+        """
+        Re-evaluate the subscribed cities whose latest AQI changed between
+        two dataset versions
+        """
+        index = get_city_index(snapshot)
+        old_index = previous.peek('city_index') if previous is not None else None
+        
+        with self._index_lock:
+            subscribed = set(self.threshold_index.cities())
+        if snapshot.changed_keys is not None:
+            subscribed &= snapshot.changed_keys
+        
+        alerts = 0
+        for key in subscribed:
+            record = index.latest.get(key)
+            if record is None or record['aqi'] is None:
+                continue
+            old_record = old_index.latest.get(key) if old_index is not None else None
+            if old_record is not None and old_record['aqi'] == record['aqi'] and old_record['date'] == record['date']:
+                continue
+            alerts += self._evaluate_city(key, float(record['aqi']))[1]
+        
+        self.events_processed += 1
+        if alerts:
+            self.alert_latencies.append(time.monotonic() - changed_at)
+        return alerts
+    
+    def run_sweep(self):
+        """
+        Check every subscription once. Each city's latest AQI is read once,
+        and the subscribers it triggers are found in the threshold index by
+        one binary search, so subscribers below their threshold are never
+        visited.
+        """
+        started = time.perf_counter()
+        
+        with self._index_lock:
+            cities = self.threshold_index.cities()
+            total = self.threshold_index.count()
+        
+        alerts = 0
+        triggered_count = 0
+        for key in cities:
+            current_aqi = self._get_current_aqi(key)
+            if current_aqi is None:
+                continue
+            triggered, sent = self._evaluate_city(key, current_aqi)
+            triggered_count += triggered
+            alerts += sent
+        
+        self.last_sweep = {
+            'subscriptions': total,
+            'cities': len(cities),
+            'triggered': triggered_count,
+            'alerts': alerts,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            'finished_at': datetime.now().isoformat()
+        }
+        print(f"AQI sweep: {total} subscriptions in {len(cities)} cities, {triggered_count} above threshold, "
+              f"{alerts} alerts, {self.last_sweep['duration_ms']} ms")
+        return self.last_sweep
+    
+    def _evaluate_city(self, key, current_aqi):
+        """
+        Alert the subscribers of one city whose threshold `current_aqi`
+        exceeds. Returns (subscribers above threshold, alerts sent).
+        """
+        with self._index_lock:
+            triggered = list(self.threshold_index.triggered(key, current_aqi))
+        
+        alerts = 0
+        for user_id in triggered:
+            subscription = self.subscriptions.get(user_id)
+            if subscription is not None and self._check_user_threshold(user_id, subscription, current_aqi):
+                alerts += 1
+        return len(triggered), alerts
+    
+    def _start_cooldown(self, user_id, subscription):
         """
-        Check if a user's threshold has been exceeded
+        Take a subscription out of the threshold index until its cooldown
+        ends, so sweeps and change events skip it without checking
+        """
+        cooldown = _cooldown_of(subscription)
+        if cooldown <= 0:
+            # Without a cooldown the subscription stays indexed and is
+            # alerted on every check above its threshold
+            return
+        
+        # Computed before the index entry is removed, so a failure cannot
+        # leave the subscription out of both the index and the scheduler
+        cooldown_until = subscription['last_alert'] + timedelta(minutes=cooldown)
+        due = time.monotonic() + cooldown * 60
+        with self._index_lock:
+            if self.subscriptions.get(user_id) is not subscription or subscription['cooldown_until'] is not None:
+                return
+            self.threshold_index.remove(user_id, subscription['location'], subscription['threshold'])
+            subscription['cooldown_until'] = cooldown_until
+            self.cooldowns.schedule(due, user_id, subscription)
+    
+    def process_due_cooldowns(self):
+        """
+        Return subscriptions whose cooldown ended to the threshold index and
+        re-check them against their city's current AQI. Only due
+        subscriptions are touched. Returns the number of alerts sent.
+        """
+        by_city = {}
+        with self._index_lock:
+            for user_id, subscription in self.cooldowns.pop_due(time.monotonic()):
+                # Skip entries of subscriptions that were removed or replaced
+                if self.subscriptions.get(user_id) is not subscription:
+                    continue
+                subscription['cooldown_until'] = None
+                self.threshold_index.add(user_id, subscription['location'], subscription['threshold'])
+                by_city.setdefault(subscription['location'], []).append((user_id, subscription))
+        
+        alerts = 0
+        for location, subscribers in by_city.items():
+            current_aqi = self._get_current_aqi(location)
+            if current_aqi is None:
+                continue
+            for user_id, subscription in subscribers:
+                if self._check_user_threshold(user_id, subscription, current_aqi):
+                    alerts += 1
+        return alerts
+    
+    def get_metrics(self):
+        """
+        Monitoring metrics: last sweep, change events handled and the delay
+        between a data change and the alerts it caused
+        """
+        latencies = sorted(self.alert_latencies)
+        latency = None
+        if latencies:
+            latency = {
+                'count': len(latencies),
+                'last_ms': round(self.alert_latencies[-1] * 1000, 3),
+                'avg_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+                'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 3),
+                'max_ms': round(latencies[-1] * 1000, 3)
+            }
+        return {
+            'subscriptions': len(self.subscriptions),
+            'last_sweep': self.last_sweep,
+            'events_processed': self.events_processed,
+            'pending_events': self._changes.qsize(),
+            'cooling_down': len(self.cooldowns),
+            'alerts_dropped': self.alerts_dropped,
+            'alert_latency': latency,
+            'delivery': get_delivery_pipeline().stats()
+        }
+    
+    def _get_current_aqi(self, location):
+        """
+        Latest AQI of a location, or None if it is unknown or has no reading
+        """
+        aqi_data = get_latest_aqi_by_location(location)
+        if not aqi_data or aqi_data.get('aqi') is None:
+            return None
+        return float(aqi_data['aqi'])
+    
+    def _check_user_threshold(self, user_id, subscription, current_aqi=None, block=False):
+        """
+        Check if a user's threshold has been exceeded, sending an alert if
+        so. Returns True when an alert was queued. Unless `block` is set, a
+        full delivery queue drops the alert at once instead of stalling the
+        monitor; the subscription is then checked again on the next event.
         """
         try:
-            location = subscription['location']
             threshold = subscription['threshold']
             
-            # Get current AQI
-            aqi_data = get_latest_aqi_by_location(location)
-            if not aqi_data or aqi_data['aqi'] is None:
-                return
-            
-            current_aqi = float(aqi_data['aqi'])
+            # Get current AQI unless the sweep already read it
+            if current_aqi is None:
+                current_aqi = self._get_current_aqi(subscription['location'])
+                if current_aqi is None:
+                    return False
             
             # Check if threshold is exceeded
             if current_aqi > threshold:
-                # Check if we've sent an alert recently (within 2 hours)
-                last_alert = subscription.get('last_alert')
-                if last_alert and datetime.now() - last_alert < timedelta(hours=2):
-                    return
+                # Subscribe, change events and sweeps may check the same
+                # subscription at once; only the one that claims it alerts
+                if not self._claim_alert(user_id, subscription):
+                    return False
                 
                 # Generate alert message
                 alert_message = get_alert_threshold_message(current_aqi)
                 
-                # Send notification (simulate - in production, use real push service)
-                self._send_push_notification(user_id, subscription, current_aqi, alert_message)
+                # The alert and cooldown only count once the notification is queued
+                sent = False
+                try:
+                    sent = self._send_push_notification(user_id, subscription, current_aqi, alert_message, block)
+                finally:
+                    self._finish_alert(subscription, sent)
+                if not sent:
+                    return False
                 
-                # Update last alert time
-                subscription['last_alert'] = datetime.now()
+                self._start_cooldown(user_id, subscription)
+                return True
                 
         except Exception as e:
             print(f"Error checking threshold for user {user_id}: {e}")
+        return False
+    
+    def _claim_alert(self, user_id, subscription):
+        """
+        Atomically check that a subscription is still current, out of its
+        cooldown and not already being alerted, and mark it as being
+        alerted. Returns True when claimed.
+        """
+        now = datetime.now()
+        with self._index_lock:
+            if self.subscriptions.get(user_id) is not subscription or subscription['cooldown_until'] is not None:
+                return False
+            if id(subscription) in self._alerting:
+                return False
+            last_alert = subscription['last_alert']
+            if last_alert and now - last_alert < timedelta(minutes=_cooldown_of(subscription)):
+                return False
+            self._alerting.add(id(subscription))
+            return True
+    
+    def _finish_alert(self, subscription, sent):
+        """
+        Release a claimed alert, recording it only if it was queued
+        """
+        with self._index_lock:
+            self._alerting.discard(id(subscription))
+            if sent:
+                subscription['last_alert'] = datetime.now()
+            else:
+                self.alerts_dropped += 1
     
-    def _send_push_notification(self, user_id, subscription, current_aqi, alert_message):
+    def _send_push_notification(self, user_id, subscription, current_aqi, alert_message, block=False):
         """
-        Send push notification to user (simulated)
+        Queue a push notification for delivery by the delivery pipeline's
+        workers, so slow transports never hold up threshold checks. Returns
+        False if the delivery queue was full and the notification dropped.
         """
         notification = {
             'user_id': user_id,
@@ -120,17 +443,14 @@ class NotificationManager:
             'level': alert_message['level'] if alert_message else "ALERT",
             'timestamp': datetime.now().isoformat(),
             'age_group': subscription.get('age_group'),
-            'health_conditions': subscription.get('health_conditions')
+            'health_conditions': subscription.get('health_conditions'),
+            'transport': subscription.get('transport') or 'log',
+            'address': subscription.get('address')
         }
         
-        # In production, this would integrate with services like:
-        # - Firebase Cloud Messaging (FCM)
-        # - Apple Push Notification Service (APNS)
-        # - Web Push Protocol
-        # - SMS/Email services
-        
-        # For now, log the notification
-        print(f"🚨 PUSH NOTIFICATION: {notification}")
+        if not get_delivery_pipeline().submit(notification, block=block):
+            print(f"Error queueing notification for user {user_id}: delivery queue is full")
+            return False
         
         # Store in alert history
         if user_id not in self.alert_history:
@@ -141,6 +461,7 @@ class NotificationManager:
         # Keep only last 10 alerts per user
         if len(self.alert_history[user_id]) > 10:
             self.alert_history[user_id] = self.alert_history[user_id][-10:]
+        return True
     
     def get_user_alert_history(self, user_id):
         """
@@ -150,9 +471,14 @@ class NotificationManager:
     
     def get_all_subscriptions(self):
         """
-        Get all active subscriptions (for admin dashboard)
+        Get all active subscriptions (for admin dashboard), without their
+        delivery addresses
         """
-        return self.subscriptions
+        with self._index_lock:
+            return {
+                user_id: {field: value for field, value in subscription.items() if field not in PRIVATE_FIELDS}
+                for user_id, subscription in self.subscriptions.items()
+            }
     
     def simulate_immediate_check(self, user_id, location=None, threshold=None):
         """
@@ -0,0 +1,124 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+CURRENT_FILE = 'CURRENT'
+
+def _generation_dir(directory, generation):
+    return os.path.join(directory, f"gen-{generation:08d}")
+
+def _codes_dtype(n_categories):
+    # Match the code width pandas picks so Categorical.from_codes does not copy
+    if n_categories < np.iinfo(np.int8).max:
+        return np.int8
+    if n_categories < np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+def read_current(directory):
+    """
+    Get the generation currently published in `directory`, or None
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return int(json.load(f)['generation'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def publish_frame(frame, directory, keep=2):
+    """
+    Publish the columns of `frame` as a new generation in `directory`.
+
+    Every column is written as a flat array that workers can map read-only:
+    datetimes as int64, strings and categoricals as codes plus a category
+    list. The CURRENT pointer is replaced in one rename, so a worker sees
+    either the old generation or the new one, never a partial write.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generation = (read_current(directory) or 0) + 1
+    target = _generation_dir(directory, generation)
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+
+    columns = []
+    for index, name in enumerate(frame.columns):
+        series = frame[name]
+        spec = {'name': name, 'file': f"col{index}.npy"}
+
+        if isinstance(series.dtype, pd.CategoricalDtype) or not (
+                pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series)):
+            categorical = series.astype('category')
+            categories = [str(c) for c in categorical.cat.categories]
+            values = categorical.cat.codes.to_numpy().astype(_codes_dtype(len(categories)))
+            spec.update({'kind': 'categorical', 'categories': categories})
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            values = series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+            spec['kind'] = 'datetime'
+        else:
+            values = series.to_numpy()
+            spec['kind'] = 'numeric'
+
+        np.save(os.path.join(target, spec['file']), values)
+        columns.append(spec)
+
+    with open(os.path.join(target, 'manifest.json'), 'w') as f:
+        json.dump({'generation': generation, 'rows': len(frame), 'columns': columns}, f)
+
+    pointer = os.path.join(directory, f"{CURRENT_FILE}.tmp{os.getpid()}")
+    with open(pointer, 'w') as f:
+        json.dump({'generation': generation}, f)
+    os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+
+    # Workers still mapping an unlinked generation keep their pages
+    for stale in sorted(glob.glob(os.path.join(directory, 'gen-*')))[:-keep]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+    return generation
+
+def attach_frame(directory, generation):
+    """
+    Build a DataFrame over the published generation without copying the
+    column data; the arrays are read-only memory maps
+    """
+    target = _generation_dir(directory, generation)
+    with open(os.path.join(target, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    data = {}
+    for spec in manifest['columns']:
+        values = np.load(os.path.join(target, spec['file']), mmap_mode='r')
+        if spec['kind'] == 'categorical':
+            data[spec['name']] = pd.Categorical.from_codes(values, spec['categories'], validate=False)
+        elif spec['kind'] == 'datetime':
+            data[spec['name']] = values.view('datetime64[ns]')
+        else:
+            data[spec['name']] = values
+
+    return pd.DataFrame(data, copy=False)
+
+if __name__ == '__main__':
+    from data_store import DatasetStore, DATA_PATH
+
+    parser = argparse.ArgumentParser(description='Publish the normalized AQI dataset for pre-forked workers')
+    parser.add_argument('directory', help='Target directory, ideally on tmpfs such as /dev/shm/aqi-dataset')
+    parser.add_argument('--path', default=DATA_PATH)
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between source file checks')
+    parser.add_argument('--once', action='store_true', help='Publish once and exit')
+    args = parser.parse_args()
+
+    store = DatasetStore(args.path)
+    published_version = None
+    while True:
+        snapshot = store.snapshot()
+        if snapshot.version != published_version:
+            generation = publish_frame(snapshot.frame, args.directory)
+            published_version = snapshot.version
+            print(f"Published generation {generation} ({len(snapshot.frame)} rows)")
+        if args.once:
+            break
+        time.sleep(args.interval)
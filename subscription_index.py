@@ -0,0 +1,155 @@
+import heapq
+from bisect import bisect_left, insort
+from city_index import normalize_city_key
+
+class ChunkedSortedList:
+    """
+    Sorted list kept as a list of sorted chunks of bounded size, with the
+    maximum of every chunk indexed separately. Insert and remove locate the
+    chunk by binary search and only shift items inside that chunk, so they
+    stay O(log n) plus a small constant for any number of items.
+    """
+    def __init__(self, chunk_size=512):
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._maxes = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, item):
+        if not self._chunks:
+            self._chunks.append([item])
+            self._maxes.append(item)
+        else:
+            i = min(bisect_left(self._maxes, item), len(self._chunks) - 1)
+            chunk = self._chunks[i]
+            insort(chunk, item)
+            self._maxes[i] = chunk[-1]
+            if len(chunk) > 2 * self.chunk_size:
+                self._chunks[i:i + 1] = [chunk[:self.chunk_size], chunk[self.chunk_size:]]
+                self._maxes[i:i + 1] = [chunk[self.chunk_size - 1], chunk[-1]]
+        self._len += 1
+
+    def remove(self, item):
+        """
+        Remove `item`; returns False if it is not present
+        """
+        i = bisect_left(self._maxes, item)
+        if i == len(self._chunks):
+            return False
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, item)
+        if j == len(chunk) or chunk[j] != item:
+            return False
+
+        del chunk[j]
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+        self._len -= 1
+        return True
+
+    def iter_below(self, bound):
+        """
+        Iterate, in order, over the items that compare below `bound`
+        """
+        last = bisect_left(self._maxes, bound)
+        for chunk in self._chunks[:last]:
+            yield from chunk
+        if last < len(self._chunks):
+            chunk = self._chunks[last]
+            yield from chunk[:bisect_left(chunk, bound)]
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+def _entry(user_id, threshold):
+    """
+    Sort entry of a subscription. Ids are kept as given, so they match the
+    subscription keys; the typed string in between orders ids of different
+    types without comparing them directly.
+    """
+    return (float(threshold), f"{type(user_id).__name__}:{user_id}", user_id)
+
+class SubscriptionIndex:
+    """
+    Subscriptions of every city sorted by threshold, so the subscribers a
+    reading triggers are found with one binary search and a slice
+    """
+    def __init__(self, chunk_size=512):
+        self.chunk_size = chunk_size
+        self._cities = {}
+
+    def add(self, user_id, location, threshold):
+        key = normalize_city_key(location)
+        entries = self._cities.get(key)
+        if entries is None:
+            entries = self._cities[key] = ChunkedSortedList(self.chunk_size)
+        entries.add(_entry(user_id, threshold))
+
+    def remove(self, user_id, location, threshold):
+        key = normalize_city_key(location)
+        entries = self._cities.get(key)
+        if entries is None:
+            return False
+        removed = entries.remove(_entry(user_id, threshold))
+        if not entries:
+            del self._cities[key]
+        return removed
+
+    def cities(self):
+        return list(self._cities)
+
+    def count(self, location=None):
+        if location is None:
+            return sum(len(entries) for entries in self._cities.values())
+        entries = self._cities.get(normalize_city_key(location))
+        return len(entries) if entries is not None else 0
+
+    def triggered(self, location, aqi):
+        """
+        User ids of the subscriptions of `location` whose threshold is below `aqi`
+        """
+        entries = self._cities.get(normalize_city_key(location))
+        if entries is None:
+            return
+        # (aqi, '') sorts before every entry with threshold aqi, so equal thresholds are excluded
+        for _, _, user_id in entries.iter_below((float(aqi), '')):
+            yield user_id
+
+class CooldownScheduler:
+    """
+    Min-heap of (due time, user id) for subscriptions in cooldown, so the
+    ones whose cooldown has ended are popped without looking at the rest.
+    Entries are never removed early; callers pass a token with each entry
+    and ignore popped entries whose token is stale.
+    """
+    def __init__(self):
+        self._heap = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, due, user_id, token=None):
+        # The sequence number keeps heap comparisons away from the tokens
+        self._sequence += 1
+        heapq.heappush(self._heap, (due, self._sequence, user_id, token))
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """
+        Remove and return the (user_id, token) entries due at or before `now`
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, user_id, token = heapq.heappop(self._heap)
+            due.append((user_id, token))
+        return due
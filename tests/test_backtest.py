@@ -0,0 +1,32 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+import backtest
+from forecast_model import fit_series
+
+
+def _series(days=400):
+    rng = np.random.default_rng(0)
+    return 150 + 40 * np.sin(np.arange(days) / 7) + rng.normal(0, 10, days)
+
+
+def test_fit_seconds_are_measured_untraced(monkeypatch):
+    # Stand in for tracemalloc's overhead: a traced fit is much slower
+    def fit(matrix, first_day):
+        if tracemalloc.is_tracing():
+            time.sleep(0.5)
+        return fit_series(matrix, first_day)
+
+    monkeypatch.setattr(backtest, 'fit_series', fit)
+    series = _series()
+    origins = backtest._origins(series, n_origins=6, step=30, horizon=7)
+
+    result = backtest.evaluate_city(series, np.datetime64('2020-01-01'), origins, 7)
+
+    assert result['fit_seconds'] < 0.5
+    assert result['peak_alloc_kb'] > 0
+    assert not tracemalloc.is_tracing()
+    assert result['origins'] == len(origins)
+    assert all(h['n'] == len(origins) for h in result['horizons'])
@@ -0,0 +1,38 @@
+import threading
+
+import pytest
+
+from chart_service import ChartService
+
+
+class SlowChartService(ChartService):
+    def __init__(self, directory):
+        super().__init__(directory=str(directory), timeout=0.05)
+        self.release = threading.Event()
+        self.renders = 0
+
+    def _render(self, location, start, end, path):
+        self.renders += 1
+        self.release.wait(5)
+        with open(path, 'wb') as f:
+            f.write(b'png')
+        return True
+
+
+def test_slow_render_times_out_and_finishes_into_cache(tmp_path):
+    service = SlowChartService(tmp_path)
+
+    with pytest.raises(TimeoutError):
+        service.get_chart('Delhi')
+    with pytest.raises(TimeoutError):
+        service.get_chart('Delhi')
+    # The timed-out render stays in flight and is shared, not restarted
+    assert service.renders == 1
+    assert len(service._pending) == 1
+
+    service.release.set()
+    service._executor.shutdown(wait=True)
+
+    assert service._pending == {}
+    assert service.get_chart('Delhi') == f"{service.chart_key('Delhi')}.png"
+    assert service.renders == 1
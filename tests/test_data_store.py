@@ -0,0 +1,25 @@
+import pandas as pd
+
+from data_store import DatasetStore
+
+HEADER = 'City,Date,PM2.5,PM10,NO,NO2,NOx,NH3,CO,SO2,O3,Benzene,Toluene,Xylene,AQI,AQI_Bucket\n'
+
+
+def _reading(day, aqi):
+    return pd.DataFrame([{'City': 'Delhi', 'Date': day, 'PM2.5': 80.0, 'AQI': aqi}])
+
+
+def test_ingest_log_has_one_line_per_row(tmp_path):
+    path = tmp_path / 'aqi.csv'
+    path.write_text(HEADER + 'Delhi,2020-01-01,90.0,,,,,,,,,,,,150,Moderate\n')
+
+    store = DatasetStore(str(path))
+    store.append(_reading('2020-01-02', 160))
+    store.append(_reading('2020-01-03', 170))
+
+    lines = open(store.log_path).read().split('\n')
+    assert lines[-1] == ''
+    assert all(lines[:-1]) and len(lines[:-1]) == 2
+
+    reloaded = DatasetStore(str(path)).snapshot().frame
+    assert list(reloaded['aqi']) == [150, 160, 170]
@@ -0,0 +1,22 @@
+import pytest
+
+from forecast_model import MAX_HORIZON, parse_horizon
+
+
+@pytest.mark.parametrize('value, expected', [(None, 3), (1, 1), ('7', 7), (5.0, 5), (MAX_HORIZON, MAX_HORIZON)])
+def test_parse_horizon_accepts_whole_days(value, expected):
+    assert parse_horizon(value) == expected
+
+
+@pytest.mark.parametrize('value', [2.7, '2.7', True, float('nan'), float('inf'), 'soon', 0, MAX_HORIZON + 1])
+def test_parse_horizon_rejects_other_values(value):
+    with pytest.raises(ValueError):
+        parse_horizon(value)
+
+
+def test_api_forecast_unknown_city_is_not_found():
+    from app_api import app
+
+    response = app.test_client().post('/api/forecast', json={'location': 'Atlantis'})
+    assert response.status_code == 404
+    assert 'Atlantis' in response.get_json()['error']
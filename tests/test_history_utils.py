@@ -0,0 +1,22 @@
+import json
+
+import pandas as pd
+
+from history_utils import iter_columnar_json, iter_ndjson
+
+
+def _rows():
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2020-01-01 00:00', '2020-01-01 13:30']),
+        'aqi': [120.0, 140.0],
+    })
+
+
+def test_ndjson_keeps_time_of_day():
+    lines = ''.join(iter_ndjson(_rows())).splitlines()
+    assert [json.loads(line)['date'] for line in lines] == ['2020-01-01T00:00:00', '2020-01-01T13:30:00']
+
+
+def test_columnar_keeps_time_of_day():
+    payload = json.loads(''.join(iter_columnar_json(_rows())))
+    assert payload['columns']['date'] == ['2020-01-01T00:00:00', '2020-01-01T13:30:00']
@@ -0,0 +1,99 @@
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from notification_delivery import FcmTransport
+
+cryptography = pytest.importorskip('cryptography')
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import padding, rsa  # noqa: E402
+
+
+class FakeGoogle(BaseHTTPRequestHandler):
+    """OAuth2 token endpoint and FCM v1 send endpoint"""
+    token_requests = []
+    messages = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/token':
+            FakeGoogle.token_requests.append(parse_qs(body.decode()))
+            self._reply(200, {'access_token': 'access-1', 'expires_in': 3600})
+        elif self.headers['Authorization'] != 'Bearer access-1':
+            self._reply(401, {})
+        else:
+            message = json.loads(body)['message']
+            FakeGoogle.messages.append(message)
+            if message['token'] == 'stale':
+                self._reply(404, {'error': {'status': 'NOT_FOUND'}})
+            elif message['token'] == 'busy':
+                self._reply(503, {'error': {'status': 'UNAVAILABLE'}})
+            else:
+                self._reply(200, {'name': 'projects/demo/messages/1'})
+
+    def _reply(self, status, payload):
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+def _unb64(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+@pytest.fixture
+def google():
+    server = HTTPServer(('127.0.0.1', 0), FakeGoogle)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_fcm_sends_through_http_v1_with_an_oauth_token(google):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    transport = FcmTransport({
+        'project_id': 'demo',
+        'client_email': 'alerts@demo.iam.gserviceaccount.com',
+        'private_key': key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption()).decode(),
+        'token_uri': f"{google}/token"
+    })
+    assert transport.endpoint == 'https://fcm.googleapis.com/v1/projects/demo/messages:send'
+    transport.endpoint = f"{google}/v1/projects/demo/messages:send"
+
+    notification = {'level': 'ALERT', 'location': 'Delhi', 'message': 'AQI 320'}
+    failures = transport.send_batch([
+        dict(notification, address='device-1'),
+        dict(notification, address='stale'),
+        dict(notification, address='busy'),
+        dict(notification, address=None),
+    ])
+
+    assert failures == [(1, False, 'NOT_FOUND'), (2, True, 'UNAVAILABLE'), (3, False, 'no device token')]
+    # One token serves the whole batch
+    assert len(FakeGoogle.token_requests) == 1
+    assert FakeGoogle.token_requests[0]['grant_type'] == ['urn:ietf:params:oauth:grant-type:jwt-bearer']
+
+    # The token request is a JWT signed with the service account key
+    header, claims, signature = FakeGoogle.token_requests[0]['assertion'][0].split('.')
+    key.public_key().verify(_unb64(signature), f"{header}.{claims}".encode(), padding.PKCS1v15(), hashes.SHA256())
+    claims = json.loads(_unb64(claims))
+    assert claims['iss'] == 'alerts@demo.iam.gserviceaccount.com'
+    assert claims['aud'] == f"{google}/token"
+    assert claims['scope'] == 'https://www.googleapis.com/auth/firebase.messaging'
+    assert FakeGoogle.messages[0]['notification'] == {'title': 'ALERT: air quality in Delhi', 'body': 'AQI 320'}
+
+
+def test_fcm_rejects_incomplete_service_accounts():
+    with pytest.raises(ValueError):
+        FcmTransport({'project_id': 'demo'})
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from data_cleaning import FLAG_DUPLICATE, FLAG_INTERPOLATED, clean_frame
+from data_store import merge_frames, normalize_raw_rows
+from partition_store import build_partitions
+
+FILL_GAP_DAYS = 3
+
+
+def _raw(rows):
+    return pd.DataFrame([{'City': city, 'Date': day, 'PM2.5': aqi / 2, 'AQI': aqi} for city, day, aqi in rows])
+
+
+def _clean(frame):
+    # The in-memory dataset: one city, re-cleaned after every append
+    frame = frame.reset_index(drop=True)
+    return clean_frame(frame, np.zeros(len(frame), dtype=np.int64), FILL_GAP_DAYS)
+
+
+def _columns(frame):
+    return frame[['date', 'aqi', 'quality_flags']].reset_index(drop=True)
+
+
+def test_ingested_rows_are_gap_filled_like_memory(tmp_path):
+    base = _raw([('Delhi', '2020-01-01', 100), ('Delhi', '2020-01-02', 110),
+                 ('Delhi', '2020-01-06', 150), ('Delhi', '2020-01-14', 230)])
+    csv_path = tmp_path / 'aqi.csv'
+    base.to_csv(csv_path, index=False)
+    store, _ = build_partitions(str(csv_path), str(tmp_path / 'partitions'), fill_gap_days=FILL_GAP_DAYS)
+
+    # Opens a gap after the 6th, closes one before the 14th and replaces
+    # a day that was interpolated at build time
+    extra = normalize_raw_rows(_raw([('Delhi', '2020-01-09', 180), ('Delhi', '2020-01-11', 200),
+                                     ('Delhi', '2020-01-04', 135)]))
+    store.ingest(extra, FILL_GAP_DAYS)
+
+    memory = _clean(merge_frames(_clean(normalize_raw_rows(base)), extra))
+    stored = store.read_range('Delhi')
+
+    pd.testing.assert_frame_equal(_columns(stored), _columns(memory))
+    flags = stored.set_index('date')['quality_flags']
+    assert flags['2020-01-07'] == FLAG_INTERPOLATED
+    assert flags['2020-01-12'] == FLAG_INTERPOLATED
+    assert flags['2020-01-04'] == FLAG_DUPLICATE
+
+
+def test_ingest_without_gap_filling_only_appends(tmp_path):
+    csv_path = tmp_path / 'aqi.csv'
+    _raw([('Delhi', '2020-01-01', 100)]).to_csv(csv_path, index=False)
+    store, _ = build_partitions(str(csv_path), str(tmp_path / 'partitions'), fill_gap_days=0)
+
+    store.ingest(normalize_raw_rows(_raw([('Delhi', '2020-01-03', 120), ('Pune', '2020-01-01', 90)])), 0)
+
+    assert list(store.read_range('Delhi')['aqi']) == [100, 120]
+    assert list(store.read_range('Pune')['aqi']) == [90]
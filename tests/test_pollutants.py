@@ -0,0 +1,34 @@
+import numpy as np
+
+from pollutants import compute_aqi
+
+
+def test_dominant_pollutant_follows_minimum_data_rule():
+    readings = {
+        'PM2.5': np.array([50.0, 50.0]),
+        'NO2': np.array([30.0, 30.0]),
+        'CO': np.array([np.nan, 12.0]),
+    }
+    aqi, bucket, dominant = compute_aqi(readings)
+
+    # Two sub-indices are too few for an AQI, so no dominant pollutant either
+    assert np.isnan(aqi[0])
+    assert bucket.isna()[0]
+    assert dominant.isna()[0]
+
+    assert aqi[1] == 229
+    assert bucket[1] == 'Poor'
+    assert dominant[1] == 'CO'
+
+
+def test_missing_readings_never_dominate():
+    readings = {
+        'PM10': np.array([np.nan, 400.0]),
+        'PM2.5': np.array([100.0, np.nan]),
+        'NO2': np.array([10.0, 10.0]),
+        'SO2': np.array([10.0, 10.0]),
+    }
+    aqi, _, dominant = compute_aqi(readings)
+
+    assert list(aqi) == [233, 362]
+    assert list(dominant) == ['PM2.5', 'PM10']
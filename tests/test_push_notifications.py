@@ -0,0 +1,83 @@
+import time
+
+import push_notifications
+from push_notifications import NotificationManager
+
+
+class SlowSendManager(NotificationManager):
+    """Holds every send open long enough for a concurrent check to overlap it"""
+
+    def _send_push_notification(self, *args, **kwargs):
+        time.sleep(0.3)
+        return super()._send_push_notification(*args, **kwargs)
+
+
+def _wait_for_sweep(manager, timeout=10):
+    deadline = time.monotonic() + timeout
+    while manager.last_sweep is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.last_sweep is not None
+
+
+def test_subscribe_alerts_once_while_the_monitor_sweeps():
+    manager = SlowSendManager()
+    try:
+        # The monitor's startup sweep races the check made by subscribe
+        manager.subscribe_user('u1', 'Delhi', threshold=0)
+        _wait_for_sweep(manager)
+        time.sleep(0.5)
+
+        assert len(manager.get_user_alert_history('u1')) == 1
+        assert manager.subscriptions['u1']['cooldown_until'] is not None
+    finally:
+        manager.monitoring_active = False
+
+
+class FullQueuePipeline:
+    """Delivery pipeline whose queue is full until `accept` is set"""
+
+    def __init__(self):
+        self.accept = False
+        self.blocking = []
+
+    def validate_address(self, transport, address):
+        pass
+
+    def submit(self, notification, block=True):
+        self.blocking.append(block)
+        return self.accept
+
+
+def test_dropped_alert_starts_no_cooldown(monkeypatch):
+    pipeline = FullQueuePipeline()
+    monkeypatch.setattr(push_notifications, 'get_delivery_pipeline', lambda: pipeline)
+    manager = NotificationManager()
+    manager.monitoring_active = True  # No monitor thread; sweeps run here
+
+    manager.subscribe_user('u1', 'Delhi', threshold=0)
+    manager.run_sweep()
+
+    subscription = manager.subscriptions['u1']
+    assert subscription['last_alert'] is None
+    assert subscription['cooldown_until'] is None
+    assert manager.get_user_alert_history('u1') == []
+    assert manager.alerts_dropped == 2
+    # Only the subscribe request may wait for room in the queue
+    assert pipeline.blocking == [True, False]
+
+    pipeline.accept = True
+    assert manager.run_sweep()['alerts'] == 1
+    assert subscription['last_alert'] is not None
+    assert subscription['cooldown_until'] is not None
+    assert len(manager.get_user_alert_history('u1')) == 1
+
+
+def test_listed_subscriptions_hide_delivery_addresses():
+    manager = NotificationManager()
+    manager.monitoring_active = True
+    manager.subscribe_user('u1', 'Atlantis', threshold=100, address='+15550100')
+
+    listed = manager.get_all_subscriptions()
+    assert 'address' not in listed['u1']
+    assert listed['u1']['location'] == 'Atlantis'
+    assert manager.subscriptions['u1']['address'] == '+15550100'
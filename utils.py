@@ -1,43 +1,17 @@
 import pandas as pd
 import numpy as np
+from data_store import get_data_store
+from city_index import get_city_index
+from dataset_cache import POLLUTANT_COLUMNS
+from history_utils import query_history
 
 def load_and_prepare_data():
-    # Read the CSV file with proper parsing
-    try:
-        # Read the CSV file normally - it has proper structure
-        df = pd.read_csv('data/aqi_data.csv')
-        
-        # Rename columns to match expected format
-        df = df.rename(columns={
-            'City': 'city',
-            'Date': 'date',
-            'AQI': 'aqi',
-            'AQI_Bucket': 'aqi_bucket'
-        })
-        
-        # Filter out rows with missing city, date, or AQI
-        df = df.dropna(subset=['city', 'date', 'aqi'])
-        
-        # Filter out rows with empty city or date
-        df = df[df['city'].str.strip() != '']
-        df = df[df['date'].str.strip() != '']
-        
-        # Convert date column to datetime
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['date'])
-        
-        # Add missing columns that the app expects
-        df['main_pollutant'] = 'PM2.5'  # Default pollutant
-        df['timestamp'] = df['date']
-        
-        # Select only the columns we need
-        df = df[['city', 'date', 'aqi', 'main_pollutant', 'timestamp']]
-        
-        return df
-        
-    except Exception as e:
-        print(f"Error loading data: {e}")
-        return pd.DataFrame()
+    """
+    Get the normalized dataset from the shared in-memory store.
+
+    The returned frame is shared between requests and must not be modified.
+    """
+    return get_data_store().get_frame()
 
 def get_available_cities():
     """
@@ -51,38 +25,47 @@ def get_available_cities():
     return sorted(df['city'].unique().tolist())
 
 def get_latest_aqi_by_location(location):
-    df = load_and_prepare_data()
+    index = get_city_index()
     
-    if df.empty:
+    if index.frame.empty:
         return None
         
-    df_location = df[df['city'].str.lower() == location.lower()]
-    
-    if df_location.empty:
+    if not index.has_city(location):
         return {
             'error': f'City "{location}" not found in dataset.'
         }
     
-    # Get the latest record with valid AQI
-    latest = df_location.sort_values('date', ascending=False).head(1)
+    # Latest record with valid AQI, precomputed for this dataset version
+    return index.get_latest(location)
+
+def get_historical_data(location, start=None, end=None):
+    """
+    Get a city's date-sorted rows, optionally restricted to [start, end].
+
+    Served from the partition store when one is configured, so only the
+    partitions overlapping the range are read.
+    """
+    df_location, _ = query_history(location, start=start, end=end)
+    return df_location if not df_location.empty else pd.DataFrame()
+
+def get_pollutant_series(location, pollutants=None):
+    """
+    Get the daily series of each pollutant for a city
+    """
+    df_location = get_city_index().get_rows(location)
     
-    if latest.empty:
+    if df_location.empty:
         return None
     
-    result = latest.to_dict(orient='records')[0]
+    names = [name for name in (pollutants or POLLUTANT_COLUMNS) if name in POLLUTANT_COLUMNS]
     
-    # Handle NaN values - convert to None or appropriate strings
-    for key, value in result.items():
-        if pd.isna(value):
-            result[key] = None
+    series = {}
+    for name in names:
+        values = df_location[name].astype(np.float64).round(2)
+        series[name] = values.astype(object).where(values.notna(), None).tolist()
     
-    return result
-
-def get_historical_data(location):
-    df = load_and_prepare_data()
-    
-    if df.empty:
-        return pd.DataFrame()
-        
-    df_location = df[df['city'].str.lower() == location.lower()]
-    return df_location.sort_values('date') if not df_location.empty else pd.DataFrame()
+    return {
+        'city': str(df_location['city'].iloc[0]),
+        'dates': df_location['date'].dt.strftime('%Y-%m-%d').tolist(),
+        'series': series
+    }